@@ -0,0 +1,335 @@
+"""Пропускная способность и задержки всех маршрутов users, todo, task и sync.
+
+    python -m fastapi_project.benchmarks.endpoints --db-url sqlite+aiosqlite:///bench.db \\
+        --users 1000 --concurrency 1 16 64 --requests 200 --output bench.json
+
+По умолчанию приложение вызывается в том же процессе через httpx ASGITransport.
+С --uvicorn поднимается отдельный процесс uvicorn с той же базой, с --url запросы
+идут на уже запущенный сервер (у него должно быть выключено ограничение частоты,
+RATE_LIMIT_USER_RATE=0 и RATE_LIMIT_IP_RATE=0). База (SQLite или PostgreSQL, --db-url или DB_URL)
+создается и заполняется генератором fake_db. Токены выпускаются напрямую с SECRET_KEY,
+поэтому у сервера должен быть тот же SECRET_KEY.
+
+Для каждого уровня конкурентности и маршрута в JSON пишутся rps, p50/p95/p99 и число
+ошибок, чтобы результаты можно было сравнивать между коммитами. Если часть запросов
+отклонена с 429 или 503, бенчмарк завершается с ошибкой.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from fastapi_project.benchmarks.stats import summarize
+
+
+PASSWORD = "bench_password"
+BATCH_SIZE = 10
+
+
+class SeededUser:
+    def __init__(self, user_id: int, username: str, token: str):
+        self.id = user_id
+        self.username = username
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.todos = []
+        self.tasks = []
+
+
+class Context:
+    """Данные засеянных пользователей, из которых собираются запросы"""
+
+    def __init__(self, users: list[SeededUser], disposable: list[SeededUser], seed: int, sync_cursor: str, words: list[str]):
+        self.users = users
+        self.disposable = disposable
+        # Слова из заметок задач для GET /task/search
+        self.words = words
+        # Курсор GET /sync на момент окончания заполнения: запросы получают изменения, сделанные бенчмарком
+        self.sync_cursor = sync_cursor
+        self.rng = random.Random(seed)
+        self.counter = 0
+
+    def unique(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix} {os.getpid()} {self.counter}"
+
+    def user(self) -> SeededUser:
+        return self.rng.choice(self.users)
+
+    def user_with(self, attribute: str, count: int = 1) -> SeededUser:
+        candidates = [user for user in self.users if len(getattr(user, attribute)) >= count]
+        if not candidates:
+            raise RuntimeError(f"Dataset is too small: no seeded user has {count} {attribute} left")
+        return self.rng.choice(candidates)
+
+    # Удаляемые объекты забираются из пула, чтобы каждый запрос удалял существующую строку
+    def pop(self, user: SeededUser, attribute: str, count: int = 1) -> list[int]:
+        items = getattr(user, attribute)
+        popped = [items.pop(self.rng.randrange(len(items))) for _ in range(count)]
+        if attribute == "todos":
+            user.tasks = [task for task in user.tasks if task[1] not in popped]
+        return popped
+
+
+def get_todo(ctx: Context):
+    user = ctx.user_with("todos")
+    return "GET", f"/todo/{ctx.rng.choice(user.todos)}", {"headers": user.headers}
+
+def update_todo(ctx: Context):
+    user = ctx.user_with("todos")
+    return "PUT", f"/todo/{ctx.rng.choice(user.todos)}", {"headers": user.headers, "json": {"title": ctx.unique("Bench todo")}}
+
+def delete_todo(ctx: Context):
+    user = ctx.user_with("todos")
+    return "DELETE", f"/todo/{ctx.pop(user, 'todos')[0]}", {"headers": user.headers}
+
+def create_task(ctx: Context):
+    user = ctx.user_with("todos")
+    return "POST", "/task", {"headers": user.headers, "json": {"todo_list": ctx.rng.choice(user.todos), "note": ctx.unique("Bench task")}}
+
+def get_task(ctx: Context):
+    user = ctx.user_with("tasks")
+    return "GET", f"/task/{ctx.rng.choice(user.tasks)[0]}", {"headers": user.headers}
+
+def update_task(ctx: Context):
+    user = ctx.user_with("tasks")
+    return "PUT", f"/task/{ctx.rng.choice(user.tasks)[0]}", {"headers": user.headers, "json": {"note": ctx.unique("Bench task")}}
+
+def delete_task(ctx: Context):
+    user = ctx.user_with("tasks")
+    task_id, todo_id = ctx.pop(user, "tasks")[0]
+    return "DELETE", f"/task/{task_id}", {"headers": user.headers}
+
+def search_tasks(ctx: Context):
+    return "GET", "/task/search", {"headers": ctx.user().headers, "params": {"q": ctx.rng.choice(ctx.words)}}
+
+def create_tasks(ctx: Context):
+    user = ctx.user_with("todos")
+    tasks = [{"todo_list": ctx.rng.choice(user.todos), "note": ctx.unique("Bench task")} for _ in range(BATCH_SIZE)]
+    return "POST", "/task/batch", {"headers": user.headers, "json": tasks}
+
+def update_tasks(ctx: Context):
+    user = ctx.user_with("tasks", BATCH_SIZE)
+    tasks = [{"id": task_id, "note": ctx.unique("Bench task")} for task_id, _ in ctx.rng.sample(user.tasks, BATCH_SIZE)]
+    return "PATCH", "/task/batch", {"headers": user.headers, "json": tasks}
+
+def delete_tasks(ctx: Context):
+    user = ctx.user_with("tasks", BATCH_SIZE)
+    task_ids = [task_id for task_id, _ in ctx.pop(user, "tasks", BATCH_SIZE)]
+    return "DELETE", "/task/batch", {"headers": user.headers, "json": task_ids}
+
+def delete_user(ctx: Context):
+    if not ctx.disposable:
+        raise RuntimeError("Dataset is too small: no disposable users left")
+    return "DELETE", "/users/me", {"headers": ctx.disposable.pop().headers}
+
+
+# Маршрут -> функция, собирающая запрос. Удаляющие маршруты идут последними
+SCENARIOS = {
+    "POST /register": lambda ctx: ("POST", "/register", {"json": {"username": ctx.unique("bench_user"), "password": PASSWORD}}),
+    "POST /login": lambda ctx: ("POST", "/login", {"json": {"username": ctx.user().username, "password": PASSWORD}}),
+    "GET /users/me": lambda ctx: ("GET", "/users/me", {"headers": ctx.user().headers}),
+    "PUT /users/me/password": lambda ctx: ("PUT", "/users/me/password", {"headers": ctx.user().headers, "json": {"old_password": PASSWORD, "new_password": PASSWORD}}),
+    "GET /todo": lambda ctx: ("GET", "/todo", {"headers": ctx.user().headers}),
+    "GET /todo/{todo_id}": get_todo,
+    "POST /todo": lambda ctx: ("POST", "/todo", {"headers": ctx.user().headers, "json": {"title": ctx.unique("Bench todo")}}),
+    "PUT /todo/{todo_id}": update_todo,
+    "GET /task": lambda ctx: ("GET", "/task", {"headers": ctx.user().headers}),
+    "GET /task/{task_id}": get_task,
+    "GET /task/search": search_tasks,
+    "POST /task": create_task,
+    "PUT /task/{task_id}": update_task,
+    "POST /task/batch": create_tasks,
+    "PATCH /task/batch": update_tasks,
+    "DELETE /task/batch": delete_tasks,
+    "GET /sync": lambda ctx: ("GET", "/sync", {"headers": ctx.user().headers, "params": {"since": ctx.sync_cursor}}),
+    "DELETE /task/{task_id}": delete_task,
+    "DELETE /todo/{todo_id}": delete_todo,
+    "DELETE /users/me": delete_user,
+}
+
+
+async def seed(args: argparse.Namespace) -> Context:
+    from sqlalchemy import func
+    from sqlmodel import select
+
+    from fastapi_project.database import User, TODOList, Task, async_session, create_db_and_tables
+    from fastapi_project.routers.users import access_token_data, create_access_token
+    from fastapi_project.utils.fake_db import populate_database
+    from fastapi_project.utils.pagination import encode_sync_cursor
+
+    await create_db_and_tables()
+    async with async_session() as session:
+        first_user = (await session.execute(select(User.id).order_by(User.id.desc()).limit(1))).scalar() or 0
+        elapsed = await populate_database(session, args.users, args.lists, args.tasks, seed=args.seed, password=PASSWORD)
+        print(f"Seeded {args.users} users in {elapsed:.1f}s", file=sys.stderr)
+        # Пользователи без данных для DELETE /users/me
+        max_requests = args.requests * len(args.concurrency)
+        await populate_database(session, max_requests, 0, 0, seed=args.seed, password=PASSWORD)
+
+        result = await session.execute(
+            select(User.id, User.username, User.password_changed_at).where(User.id > first_user).order_by(User.id)
+        )
+        rows = result.tuples().all()
+
+        def seeded_user(user_id, username, password_changed_at):
+            token = create_access_token(access_token_data(user_id, username, password_changed_at), timedelta(minutes=args.token_ttl))
+            return SeededUser(user_id, username, token)
+
+        users = {row[0]: seeded_user(*row) for row in rows[:args.users][:args.sample_users]}
+        disposable = [seeded_user(*row) for row in rows[args.users:]]
+
+        result = await session.execute(select(TODOList.id, TODOList.user).where(TODOList.user.in_(users)))
+        for todo_id, user_id in result.tuples():
+            users[user_id].todos.append(todo_id)
+        result = await session.execute(
+            select(Task.id, Task.todo_list, TODOList.user).join(TODOList, Task.todo_list==TODOList.id).where(TODOList.user.in_(users))
+        )
+        for task_id, todo_id, user_id in result.tuples():
+            users[user_id].tasks.append((task_id, todo_id))
+        changed_at = [(await session.execute(select(func.max(model.updated_at)))).scalar() for model in (TODOList, Task)]
+        changed_at = max(filter(None, changed_at), default=datetime(1970, 1, 1))
+        notes = (await session.execute(select(Task.note).limit(100))).scalars().all()
+        words = sorted({word for note in notes if note for word in note.split()}) or ["task"]
+    return Context(list(users.values()), disposable, args.seed, encode_sync_cursor(changed_at), words)
+
+
+async def run_route(client: httpx.AsyncClient, ctx: Context, route: str, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            method, url, kwargs = SCENARIOS[route](ctx)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {**summarize(latencies, time.perf_counter() - started), "errors": errors}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_uvicorn(workers: int) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "fastapi_project.main:app",
+        "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ])
+    url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient(base_url=url) as client:
+        for _ in range(100):
+            try:
+                await client.get("/metrics")
+                return process, url
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> dict:
+    from fastapi_project.config import settings
+
+    ctx = await seed(args)
+    process = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        target = args.url
+    elif args.uvicorn:
+        process, url = await start_uvicorn(args.workers)
+        client = httpx.AsyncClient(base_url=url, timeout=60, limits=httpx.Limits(max_connections=max(args.concurrency)))
+        target = f"uvicorn --workers {args.workers}"
+    else:
+        from fastapi_project.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+        target = "asgi"
+
+    routes = [route for route in SCENARIOS if not args.routes or route in args.routes]
+    results = {}
+    try:
+        async with client:
+            for concurrency in args.concurrency:
+                for route in routes:
+                    result = await run_route(client, ctx, route, args.requests, concurrency)
+                    results.setdefault(str(concurrency), {})[route] = result
+                    print(
+                        f"c={concurrency:<4} {route:<28} {result['rps']:>9} rps"
+                        f"  p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms"
+                        f"  errors={result['errors']}",
+                        file=sys.stderr,
+                    )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    return {
+        "revision": git_revision(),
+        "target": target,
+        "database": settings.DB_URL.split(":", 1)[0],
+        "dataset": {"users": args.users, "lists": args.lists, "tasks": args.tasks, "seed": args.seed},
+        "requests": args.requests,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", help="overrides DB_URL for the app, the server and the seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--lists", type=int, default=5, help="todo lists per user")
+    parser.add_argument("--tasks", type=int, default=10, help="tasks per todo list")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-users", type=int, default=200, help="seeded users the requests are spread over")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--routes", nargs="*", help='only these routes, e.g. "GET /todo"')
+    parser.add_argument("--uvicorn", action="store_true", help="run the app in a separate uvicorn process")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--url", help="benchmark an already running server")
+    parser.add_argument("--token-ttl", type=int, default=60, help="lifetime of the minted tokens in minutes")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    # Настройки читаются при импорте приложения, поэтому DB_URL задается до первого импорта
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    # Все запросы идут с одного адреса от немногих пользователей: с ограничением частоты бенчмарк измерял бы отказы.
+    # Процесс uvicorn наследует окружение, у сервера из --url ограничение нужно выключить самому
+    os.environ["RATE_LIMIT_USER_RATE"] = os.environ["RATE_LIMIT_IP_RATE"] = "0"
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    # Ответы 429 и 503 - отказы ограничителей, а не работа маршрута, такие результаты сравнивать нельзя
+    rejected = sum(
+        result["errors"].get(status, 0)
+        for routes in report["results"].values() for result in routes.values() for status in (429, 503)
+    )
+    if rejected:
+        sys.exit(f"{rejected} requests were rejected with 429 or 503, see errors in the results")
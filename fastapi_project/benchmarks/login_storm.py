@@ -0,0 +1,89 @@
+"""Задержка посторонних запросов во время шторма логинов.
+
+Пока десятки клиентов одновременно логинятся, отдельный клиент опрашивает
+GET /metrics, которому не нужны ни bcrypt, ни база. Если хэширование блокирует
+event loop, p99 этого эндпоинта вырастает до времени нескольких bcrypt.
+
+    python -m fastapi_project.benchmarks.login_storm --logins 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from fastapi_project.benchmarks.stats import percentile
+from fastapi_project.config import settings
+from fastapi_project.database import create_db_and_tables
+from fastapi_project.main import app
+
+
+USERNAME = "bench_login_storm"
+PASSWORD = "bench_password"
+
+
+async def probe(client: AsyncClient, stop: asyncio.Event, latencies: list[float]):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/metrics")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+
+
+async def login_storm(client: AsyncClient, logins: int, concurrency: int) -> dict[int, int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async def login():
+        async with semaphore:
+            response = await client.post("/login", json={"username": USERNAME, "password": PASSWORD})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    await asyncio.gather(*(login() for _ in range(logins)))
+    return statuses
+
+
+# Опрос идет, пока выполняется нагрузка (или 2 секунды без нее)
+async def measure(client: AsyncClient, load=None) -> tuple[list[float], object]:
+    stop = asyncio.Event()
+    latencies = []
+    prober = asyncio.create_task(probe(client, stop, latencies))
+    result = await (load if load is not None else asyncio.sleep(2))
+    stop.set()
+    await prober
+    return latencies, result
+
+
+def report(name: str, latencies: list[float]):
+    print(
+        f"{name:>12}: n={len(latencies)}"
+        f" p50={percentile(latencies, 0.50) * 1000:.1f}ms"
+        f" p99={percentile(latencies, 0.99) * 1000:.1f}ms"
+        f" max={max(latencies) * 1000:.1f}ms"
+    )
+
+
+async def main(logins: int, concurrency: int):
+    # Все логины идут с одного адреса: с ограничением по адресу шторм почти целиком состоял бы из ответов 429
+    settings.RATE_LIMIT_IP_RATE = 0
+    await create_db_and_tables()
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        await client.post("/register", json={"username": USERNAME, "password": PASSWORD})
+        latencies, _ = await measure(client)
+        report("idle", latencies)
+        started = time.perf_counter()
+        latencies, statuses = await measure(client, login_storm(client, logins, concurrency))
+        report("login storm", latencies)
+        print(f"{logins} logins in {time.perf_counter() - started:.1f}s, statuses: {statuses}")
+    failed = logins - statuses.get(200, 0)
+    if failed:
+        sys.exit(f"{failed} logins did not succeed, the storm did not measure bcrypt")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.concurrency))
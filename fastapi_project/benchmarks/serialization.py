@@ -0,0 +1,95 @@
+"""Процессорное время на 10 000 задач ответа GET /task: выборка и сериализация в JSON.
+
+    python -m fastapi_project.benchmarks.serialization --db-url sqlite+aiosqlite:///bench.db --rows 10000
+
+Сравниваются ORM-объекты с jsonable_encoder (прежний путь кэша ответов), ORM-объекты
+через response_model FastAPI (проверка и сериализация Pydantic) и кортежи колонок с RowEncoder
+(LIST_ENCODER="rows" и, если установлен orjson, "orjson").
+Время - time.process_time, то есть и поток драйвера базы, лучший из --repeat замеров,
+пересчитанный на 10 000 строк.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+PASSWORD = "bench_password"
+
+
+async def main(args: argparse.Namespace) -> dict:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    from sqlmodel import select
+
+    from fastapi_project.config import settings
+    from fastapi_project.database import Task, TODOList, User, async_session, create_db_and_tables
+    from fastapi_project.utils import serialization
+    from fastapi_project.utils.fake_db import populate_database
+    from fastapi_project.utils.serialization import RowEncoder, dumps
+
+    await create_db_and_tables()
+    async with async_session() as session:
+        first_user = (await session.execute(select(User.id).order_by(User.id.desc()).limit(1))).scalar() or 0
+        await populate_database(session, 1, 10, args.rows // 10, seed=args.seed, password=PASSWORD)
+    query = select(Task).join(TODOList, Task.todo_list==TODOList.id).where(TODOList.user==first_user + 1).order_by(Task.id)
+    encoder = RowEncoder(Task)
+    response_model = TypeAdapter(list[Task])
+
+    async def orm_jsonable_encoder(session):
+        tasks = (await session.execute(query)).scalars().all()
+        return dumps(jsonable_encoder(tasks))
+
+    async def orm_response_model(session):
+        tasks = (await session.execute(query)).scalars().all()
+        return response_model.dump_json(response_model.validate_python(tasks, from_attributes=True))
+
+    def rows_encoder(list_encoder: str):
+        async def run(session):
+            settings.LIST_ENCODER = list_encoder
+            rows = (await session.execute(query.with_only_columns(*encoder.columns))).all()
+            return encoder.encode(rows)
+        return run
+
+    runs = [
+        ("orm + jsonable_encoder", orm_jsonable_encoder),
+        ("orm + response_model", orm_response_model),
+        ("rows + RowEncoder", rows_encoder("rows")),
+    ]
+    if serialization.orjson is not None:
+        runs.append(("rows + RowEncoder orjson", rows_encoder("orjson")))
+    results = {}
+    for name, run in runs:
+        timings = []
+        for _ in range(args.repeat):
+            # Новая сессия на каждый замер, как у запроса: identity map пуста
+            async with async_session() as session:
+                started = time.process_time()
+                body = await run(session)
+                timings.append(time.process_time() - started)
+        rows = len(json.loads(body))
+        results[name] = {"rows": rows, "cpu_ms_per_10k": round(min(timings) * 1000 * 10000 / rows, 1)}
+        print(f"{name:<24} {results[name]['cpu_ms_per_10k']:>8} ms CPU / 10k rows", file=sys.stderr)
+
+    return {"orjson": serialization.orjson is not None, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", help="overrides DB_URL for the seeding and the queries")
+    parser.add_argument("--rows", type=int, default=10000, help="tasks of the benchmarked user")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    # Настройки читаются при импорте приложения, поэтому DB_URL задается до первого импорта
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
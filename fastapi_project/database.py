@@ -1,19 +1,52 @@
-from typing import Annotated
+import time
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+from functools import partial
+from typing import Annotated, AsyncContextManager, Callable
+from weakref import WeakKeyDictionary
 
 from sqlmodel import Field, SQLModel, Relationship
 
-from fastapi import Depends
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from fastapi import Depends, Request
+from sqlalchemy import DDL, DateTime, Index, QueuePool, event, make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
 from pathlib import Path
 from fastapi_project.config import settings
+from fastapi_project.utils.instrumentation import instrument_engine
+from fastapi_project.utils.metrics import Gauge, Histogram
+from fastapi_project.utils.rate_limit import ConcurrencyLimiter
+from fastapi_project.utils.replica import read_router, token_user_id
 
 
-# Таблицы
+# Текущее время UTC на стороне базы с миллисекундами: CURRENT_TIMESTAMP в SQLite хранит только секунды
+class utcnow(FunctionElement):
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW')"
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+# Таблицы. version и updated_at меняются при каждом изменении строки, по ним считаются ETag
 class Task(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    todo_list: int = Field(default=..., foreign_key="todolist.id")
+    todo_list: int = Field(default=..., foreign_key="todolist.id", ondelete="CASCADE")
     note: str | None = Field(default=None)
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    updated_at: datetime | None = Field(default=None, nullable=False, sa_column_kwargs={"server_default": utcnow()})
+
+    # Изменения задач для GET /sync ищутся по todo пользователя. Индекс начинается с todo_list и заменяет индекс по внешнему ключу
+    __table_args__ = (Index("ix_task_todo_list_updated_at", "todo_list", "updated_at"),)
     
     # Добавление отношения к TODOList
     todo_list_rel: "TODOList" = Relationship(back_populates="tasks")
@@ -21,25 +54,106 @@ class Task(SQLModel, table=True):
 
 class TODOList(SQLModel, table=True):
     id: int = Field(default=..., primary_key=True)
-    user: int = Field(default=..., foreign_key="user.id")
+    user: int = Field(default=..., foreign_key="user.id", ondelete="CASCADE")
     title: str
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    updated_at: datetime | None = Field(default=None, nullable=False, sa_column_kwargs={"server_default": utcnow()})
+
+    # Названия уникальны в пределах пользователя. Индекс начинается с user и заменяет индекс по внешнему ключу
+    __table_args__ = (
+        Index("ix_todolist_user_title", "user", "title", unique=True),
+        Index("ix_todolist_user_updated_at", "user", "updated_at"),
+    )
 
     # Добавление отношения к User
     user_rel: "User" = Relationship(back_populates="todo_lists")
 
     # Добавление отношения к Task
-    tasks: list[Task] = Relationship(back_populates="todo_list_rel", cascade_delete=True)
+    # Дочерние строки удаляет база (ON DELETE CASCADE), ORM не загружает их перед удалением
+    tasks: list[Task] = Relationship(back_populates="todo_list_rel", cascade_delete=True, passive_deletes=True)
 
 
 class User(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True)
     password: str
+    # Время регистрации или последней смены пароля, попадает в токен: токены, выданные раньше, не действуют
+    password_changed_at: datetime | None = Field(default=None, nullable=False, sa_column_kwargs={"server_default": utcnow()})
 
     # Добавление отношения к TODOList
-    todo_lists: list[TODOList] = Relationship(back_populates="user_rel", cascade_delete=True)
+    todo_lists: list[TODOList] = Relationship(back_populates="user_rel", cascade_delete=True, passive_deletes=True)
 
 
+# Удаленные todo и задачи для GET /sync. Строки добавляют триггеры базы, поэтому удаление остается одним запросом.
+# Задачи, удаленные вместе со своим todo, отдельных записей не получают, как и todo удаляемого пользователя
+class Tombstone(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    user: int = Field(default=..., foreign_key="user.id", ondelete="CASCADE")
+    kind: str
+    entity_id: int
+    deleted_at: datetime | None = Field(default=None, nullable=False, sa_column_kwargs={"server_default": utcnow()})
+
+    __table_args__ = (Index("ix_tombstone_user_deleted_at", "user", "deleted_at"),)
+
+
+TOMBSTONE_TRIGGERS = {
+    "sqlite": [
+        """CREATE TRIGGER todolist_tombstone AFTER DELETE ON todolist BEGIN
+            INSERT INTO tombstone (user, kind, entity_id) SELECT id, 'todo', OLD.id FROM user WHERE id = OLD.user;
+        END""",
+        """CREATE TRIGGER task_tombstone AFTER DELETE ON task BEGIN
+            INSERT INTO tombstone (user, kind, entity_id) SELECT user, 'task', OLD.id FROM todolist WHERE id = OLD.todo_list;
+        END""",
+    ],
+    "postgresql": [
+        """CREATE FUNCTION todolist_tombstone() RETURNS trigger AS $$ BEGIN
+            INSERT INTO tombstone ("user", kind, entity_id) SELECT id, 'todo', OLD.id FROM "user" WHERE id = OLD."user";
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        "CREATE TRIGGER todolist_tombstone AFTER DELETE ON todolist FOR EACH ROW EXECUTE FUNCTION todolist_tombstone()",
+        """CREATE FUNCTION task_tombstone() RETURNS trigger AS $$ BEGIN
+            INSERT INTO tombstone ("user", kind, entity_id) SELECT "user", 'task', OLD.id FROM todolist WHERE id = OLD.todo_list;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        "CREATE TRIGGER task_tombstone AFTER DELETE ON task FOR EACH ROW EXECUTE FUNCTION task_tombstone()",
+    ],
+}
+
+# Полнотекстовый поиск по Task.note. В PostgreSQL - вычисляемая колонка tsvector с GIN-индексом по (todo_list, tsvector),
+# в SQLite - таблица FTS5 над task с колонкой todo_list, которую обновляют триггеры. todo_list в индексе ограничивает
+# поиск задачами пользователя. В модели Task колонки поиска нет, запросы к ним строит utils/search.py
+TASK_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE task_fts USING fts5(note, todo_list, content='task', content_rowid='id')",
+        """CREATE TRIGGER task_fts_insert AFTER INSERT ON task BEGIN
+            INSERT INTO task_fts (rowid, note, todo_list) VALUES (NEW.id, NEW.note, NEW.todo_list);
+        END""",
+        """CREATE TRIGGER task_fts_delete AFTER DELETE ON task BEGIN
+            INSERT INTO task_fts (task_fts, rowid, note, todo_list) VALUES ('delete', OLD.id, OLD.note, OLD.todo_list);
+        END""",
+        """CREATE TRIGGER task_fts_update AFTER UPDATE OF note, todo_list ON task BEGIN
+            INSERT INTO task_fts (task_fts, rowid, note, todo_list) VALUES ('delete', OLD.id, OLD.note, OLD.todo_list);
+            INSERT INTO task_fts (rowid, note, todo_list) VALUES (NEW.id, NEW.note, NEW.todo_list);
+        END""",
+    ],
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "ALTER TABLE task ADD COLUMN note_search tsvector GENERATED ALWAYS AS (to_tsvector('simple', coalesce(note, ''))) STORED",
+        "CREATE INDEX ix_task_todo_list_note_search ON task USING GIN (todo_list, note_search)",
+    ],
+}
+
+# Триггеры и поиск создаются после всех таблиц. Функции PostgreSQL и таблица FTS5 удаляются вместе с таблицами
+for ddl in (TOMBSTONE_TRIGGERS, TASK_SEARCH_DDL):
+    for dialect, statements in ddl.items():
+        for statement in statements:
+            event.listen(SQLModel.metadata, "after_create", DDL(statement).execute_if(dialect=dialect))
+event.listen(
+    SQLModel.metadata, "after_drop",
+    DDL("DROP FUNCTION IF EXISTS todolist_tombstone, task_tombstone").execute_if(dialect="postgresql"),
+)
+event.listen(SQLModel.metadata, "after_drop", DDL("DROP TABLE IF EXISTS task_fts").execute_if(dialect="sqlite"))
+
 
 # Модели
 class TODOListCreate(SQLModel):
@@ -52,10 +166,34 @@ class TaskCreate(SQLModel):
 class TaskUpdate(SQLModel):
     note: str
 
+class TaskBatchUpdate(SQLModel):
+    id: int
+    note: str
+
+# Результат для одного элемента пакетного запроса
+class TaskBatchResult(SQLModel):
+    index: int
+    status: int
+    task: Task | None = None
+    detail: str | None = None
+
+# Ответ GET /sync. more - изменений больше limit, следующую часть клиент получает с cursor
+class SyncResult(SQLModel):
+    todos: list[TODOList]
+    tasks: list[Task]
+    deleted_todos: list[int]
+    deleted_tasks: list[int]
+    cursor: str
+    more: bool = False
+
 class UserRegister(SQLModel):
     username: str
     password: str
 
+class UserPasswordUpdate(SQLModel):
+    old_password: str
+    new_password: str
+
 class UserRead(SQLModel):
     id: int
     username: str
@@ -64,15 +202,117 @@ class UserRead(SQLModel):
         orm_mode = True
 
 
-engine = create_async_engine(settings.DB_URL)
+# Ограничители сессий по движкам: у основной базы и реплики свои пулы, поэтому и свои ограничители
+admission_limiters: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def make_engine(url: str) -> AsyncEngine:
+    url = make_url(url)
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+    # SQLite в памяти работает на StaticPool, у которого нет размера и очереди
+    if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    engine = create_async_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", enable_foreign_keys)
+    event.listen(engine.sync_engine, "checkout", partial(update_pool_metrics, engine))
+    event.listen(engine.sync_engine, "checkin", partial(update_pool_metrics, engine))
+    instrument_engine(engine)
+    admission_limiters[engine.sync_engine] = ConcurrencyLimiter(
+        settings.DB_ADMISSION_LIMIT or settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW,
+        settings.DB_ADMISSION_QUEUE,
+        settings.DB_ADMISSION_TIMEOUT,
+        name=url.database or "",
+    )
+    return engine
+
+
+# SQLite проверяет внешние ключи и выполняет ON DELETE CASCADE только с этой настройкой, она действует на соединение
+def enable_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def update_pool_metrics(engine: AsyncEngine, *args):
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return
+    checked_out = pool.checkedout()
+    pool_checked_out.set(checked_out, database=engine.url.database)
+    pool_saturation.set(checked_out / (pool.size() + settings.DB_MAX_OVERFLOW), database=engine.url.database)
+
+
+pool_checkout_seconds = Histogram("db_pool_checkout_seconds", "Time spent waiting for a pooled connection")
+pool_checked_out = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", ("database",))
+pool_saturation = Gauge("db_pool_saturation", "Checked out connections relative to pool_size + max_overflow", ("database",))
+
+engine = make_engine(settings.DB_URL)
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Реплика для чтения, если задан REPLICA_DB_URL
+replica_engine = make_engine(settings.REPLICA_DB_URL) if settings.REPLICA_DB_URL else None
+replica_session = async_sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False) if replica_engine else None
 
 async def create_db_and_tables():
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
 
 
-async def get_session(engine) -> AsyncSession:
-    async with AsyncSession(engine) as session:
+# Сессия, которая сначала занимает место в ограничителе сессий своего движка
+@asynccontextmanager
+async def open_session(session_factory: async_sessionmaker):
+    bind = session_factory.kw.get("bind")
+    limiter = admission_limiters.get(bind.sync_engine) if bind is not None else None
+    async with limiter.slot() if limiter is not None else nullcontext(), session_factory() as session:
+        yield session
+
+
+# Фабрика сессий основной базы
+def get_session_factory() -> async_sessionmaker:
+    return async_session
+
+
+# Фабрика для потоковых ответов, которые открывают сессию сами: сессия из SessionDP
+# закрывается раньше, чем FastAPI начинает отправлять тело ответа. Эти сессии тоже проходят через ограничитель,
+# но ждут места уже после заголовков ответа, и отказ обрывает поток
+def get_streaming_session_factory(session_factory: Annotated[async_sessionmaker, Depends(get_session_factory)]) -> Callable[[], AsyncContextManager[AsyncSession]]:
+    return partial(open_session, session_factory)
+
+SessionFactoryDP = Annotated[Callable[[], AsyncContextManager[AsyncSession]], Depends(get_streaming_session_factory)]
+
+
+# Фабрика сессий реплики или None, если реплика не настроена
+def get_replica_session_factory() -> async_sessionmaker | None:
+    return replica_session
+
+
+# Сессия на время запроса. Соединение берется из пула сразу, чтобы измерить ожидание в очереди пула.
+# Перед этим запрос занимает место в ограничителе сессий выбранной базы (utils/rate_limit.py) и при перегрузке
+# получает 503, не дожидаясь таймаута пула. С репликой GET-запросы читают из нее, кроме недавно писавших пользователей (utils/replica.py)
+async def get_session(
+    request: Request,
+    session_factory: Annotated[async_sessionmaker, Depends(get_session_factory)],
+    replica_factory: Annotated[async_sessionmaker | None, Depends(get_replica_session_factory)],
+) -> AsyncSession:
+    user_id = target = None
+    if replica_factory is not None:
+        user_id = token_user_id(request.headers.get("Authorization"))
+        target, _ = await read_router.route(request.method, user_id)
+        if target == "replica":
+            session_factory = replica_factory
+    async with open_session(session_factory) as session:
+        started = time.perf_counter()
+        await session.connection()
+        pool_checkout_seconds.observe(time.perf_counter() - started)
         yield session
+    # Окно чтения своих записей отсчитывается от конца запроса
+    if target is not None and request.method not in ("GET", "HEAD") and user_id is not None:
+        await read_router.mark_write(user_id)
 
-SessionDP = Annotated[AsyncSession, Depends(get_session(engine))]
\ No newline at end of file
+SessionDP = Annotated[AsyncSession, Depends(get_session)]
@@ -1,15 +1,27 @@
-from fastapi import FastAPI
-from fastapi_project.routers import todo, task, users
-from fastapi_project import database
+import time
+# Время импорта приложения отсчитывается до остальных импортов
+IMPORT_STARTED = time.perf_counter()
 
-app = FastAPI()
+from functools import partial
 
-app.include_router(users.user_router, tags=["users"])
-app.include_router(todo.todo_router, tags=["todos"])
-app.include_router(task.task_router, tags=["tasks"])
+from fastapi import Depends, FastAPI
+from fastapi_project.routers import todo, task, users, export, imports, metrics, sync, events
+from fastapi_project.startup import lifespan, startup_seconds
+from fastapi_project.utils.instrumentation import InstrumentationMiddleware
+
+app = FastAPI(lifespan=partial(lifespan, started=IMPORT_STARTED))
+app.add_middleware(InstrumentationMiddleware)
 
+# Ограничение частоты запросов пользователя на всех маршрутах с авторизацией, кроме /users (там оно задано у маршрутов)
+user_rate_limit = Depends(users.limit_user)
+
+app.include_router(users.user_router, tags=["users"])
+app.include_router(todo.todo_router, tags=["todos"], dependencies=[user_rate_limit])
+app.include_router(task.task_router, tags=["tasks"], dependencies=[user_rate_limit])
+app.include_router(sync.sync_router, tags=["sync"], dependencies=[user_rate_limit])
+app.include_router(events.events_router, tags=["events"], dependencies=[user_rate_limit])
+app.include_router(export.export_router, tags=["export"], dependencies=[user_rate_limit])
+app.include_router(imports.import_router, tags=["import"], dependencies=[user_rate_limit])
+app.include_router(metrics.metrics_router, tags=["metrics"])
 
-if __name__ == "__main__":
-    @app.on_event("startup")
-    async def startup_event():
-        await database.create_db_and_tables()
\ No newline at end of file
+startup_seconds.set(time.perf_counter() - IMPORT_STARTED, phase="import")
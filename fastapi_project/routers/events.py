@@ -0,0 +1,44 @@
+import asyncio
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+
+from fastapi_project.config import settings
+from fastapi_project.routers.users import get_current_user
+from fastapi_project.utils.events import OVERFLOW, EventBrokerDP
+from fastapi_project.utils.instrumentation import query_budget
+
+
+events_router = APIRouter()
+
+
+async def event_stream(broker, user_id: int):
+    async with broker.subscribe(user_id) as subscription:
+        # Первая строка сразу отправляет заголовки, retry - пауза перед переподключением EventSource
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), settings.EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            if event is OVERFLOW:
+                yield b'data: {"type":"overflow","data":[]}\n\n'
+                return
+            yield b"data: " + event + b"\n\n"
+
+
+# Изменения todo и задач пользователя в формате Server-Sent Events, JSON с type и data в каждом сообщении.
+# Типы: todo.created, todo.updated, todo.deleted (вместе с задачами), task.created, task.updated, task.deleted,
+# resync (изменений много, например после импорта), import.progress и import.failed (ход POST /import)
+# и overflow (клиент не успевал читать или воркер терял соединение с брокером, поток закрыт).
+# Доставка не гарантирована: после переподключения, resync и overflow клиент догоняет через GET /sync.
+# Поток не держит соединение с базой: сессия авторизации закрывается до начала ответа
+@events_router.get("/events", dependencies=[query_budget(1)])
+async def events(broker: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> StreamingResponse:
+    return StreamingResponse(
+        event_stream(broker, current_user),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,87 @@
+import json
+import zlib
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+
+from fastapi_project.database import Task, TODOList, SessionFactoryDP
+from fastapi_project.routers.users import get_current_user
+
+
+export_router = APIRouter()
+
+# Сколько строк забирать из курсора за раз и сколько байт копить перед отправкой
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+
+# Todo пользователя со вложенными задачами. Строки читаются курсором, отсортированные по todo,
+# и каждый todo пишется по мере чтения, поэтому в памяти не держится ни один список целиком
+async def export_todos(session_factory, user_id: int, separator: str, terminator: str):
+    query = (
+        select(TODOList.id, TODOList.title, Task.id, Task.note)
+        .outerjoin(Task, Task.todo_list==TODOList.id)
+        .where(TODOList.user==user_id)
+        .order_by(TODOList.id, Task.id)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    )
+    async with session_factory() as session:
+        result = await session.stream(query)
+        current = None
+        async for todo_id, title, task_id, note in result:
+            if todo_id != current:
+                if current is not None:
+                    yield "]}" + terminator + separator
+                current = todo_id
+                first_task = True
+                yield json.dumps({"id": todo_id, "user": user_id, "title": title})[:-1] + ', "tasks": ['
+            if task_id is not None:
+                yield ("" if first_task else ", ") + json.dumps({"id": task_id, "todo_list": todo_id, "note": note})
+                first_task = False
+        if current is not None:
+            yield "]}" + terminator
+
+
+# Склеивает мелкие куски в блоки по EXPORT_BUFFER_SIZE байт
+async def buffered(chunks, start: str = "", end: str = ""):
+    buffer = [start.encode()]
+    size = len(buffer[0])
+    async for chunk in chunks:
+        chunk = chunk.encode()
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(end.encode())
+    yield b"".join(buffer)
+
+
+async def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# Выгрузка всех todo и задач пользователя: NDJSON (todo на строку) или JSON-массив в gzip
+@export_router.get("/export")
+async def export(
+    session_factory: SessionFactoryDP,
+    current_user: Annotated[str, Depends(get_current_user)],
+    format: Literal["ndjson", "json.gz"] = "ndjson",
+) -> StreamingResponse:
+    if format == "ndjson":
+        body = buffered(export_todos(session_factory, current_user, "", "\n"))
+        return StreamingResponse(body, media_type="application/x-ndjson")
+    body = gzipped(buffered(export_todos(session_factory, current_user, ", ", ""), "[", "]"))
+    return StreamingResponse(
+        body,
+        media_type="application/gzip",
+        headers={"Content-Disposition": 'attachment; filename="export.json.gz"'},
+    )
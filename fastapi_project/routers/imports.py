@@ -0,0 +1,146 @@
+import json
+import logging
+import uuid
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.exc import IntegrityError
+
+from fastapi_project.config import settings
+from fastapi_project.database import Task, TODOList, TaskCreate, TODOListCreate, SessionDP
+from fastapi_project.routers.users import get_current_user
+from fastapi_project.utils.bulk import copy_rows, insert_returning_ids
+from fastapi_project.utils.events import EventBrokerDP
+from fastapi_project.utils.response_cache import ResponseCacheDP
+
+
+logger = logging.getLogger(__name__)
+
+import_router = APIRouter()
+
+# Сколько todo и задач накапливать перед записью в базу
+IMPORT_CHUNK_SIZE = 5000
+
+
+# Строки тела запроса. Строка без перевода строки накапливается в памяти,
+# поэтому ее длина ограничена: todo со всеми вложенными задачами занимает одну строку
+async def read_lines(request: Request, max_length: int):
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > max_length or any(len(line) > max_length for line in lines):
+            raise HTTPException(status_code=413, detail=f"Line is longer than {max_length} bytes")
+        for line in lines:
+            yield line
+    yield buffer
+
+
+class Importer:
+    """Загрузка todo и задач одной транзакцией.
+
+    Задачи ссылаются на todo по id из импортируемого файла, поэтому сначала записываются
+    накопленные todo, а потом задачи с уже известными новыми id. Задача может стоять в файле
+    раньше своего todo: такие задачи ждут, пока todo не будет записан, и проверяются в конце импорта.
+    После каждой записи в базу прогресс уходит событием import.progress в GET /events.
+    """
+
+    def __init__(self, session, events, user_id: int):
+        self.session = session
+        self.events = events
+        self.user_id = user_id
+        self.id = uuid.uuid4().hex
+        self.todo_ids = {}
+        self.pending_todos = []
+        self.pending_tasks = []
+        # Задачи, чей todo еще не встречался в файле
+        self.waiting_tasks = []
+        self.todos = 0
+        self.tasks = 0
+
+    def add_todo(self, ref: int, todo: TODOListCreate):
+        self.pending_todos.append((ref, todo))
+
+    def add_task(self, task: TaskCreate):
+        self.pending_tasks.append(task)
+
+    @property
+    def full(self) -> bool:
+        return len(self.pending_todos) + len(self.pending_tasks) >= IMPORT_CHUNK_SIZE
+
+    # final - последняя запись: задачи, чей todo так и не встретился в файле, отменяют импорт
+    async def flush(self, final: bool = False):
+        try:
+            ids = await insert_returning_ids(
+                self.session, TODOList, [{"user": self.user_id, "title": todo.title} for _, todo in self.pending_todos]
+            )
+        except IntegrityError:
+            raise HTTPException(status_code=400, detail="Todo with this title already exists")
+        for (ref, _), todo_id in zip(self.pending_todos, ids):
+            self.todo_ids[ref] = todo_id
+        rows = []
+        waiting = []
+        for task in self.waiting_tasks + self.pending_tasks:
+            if task.todo_list in self.todo_ids:
+                rows.append((self.todo_ids[task.todo_list], task.note))
+            elif final:
+                raise HTTPException(status_code=400, detail=f"Unknown todo list {task.todo_list}")
+            else:
+                waiting.append(task)
+        await copy_rows(self.session, Task.__table__, ["todo_list", "note"], rows)
+
+        self.todos += len(self.pending_todos)
+        self.tasks += len(rows)
+        self.pending_todos = []
+        self.pending_tasks = []
+        self.waiting_tasks = waiting
+        self.report("import.progress")
+        logger.info("Import for user %s: %s todos, %s tasks loaded", self.user_id, self.todos, self.tasks)
+
+    def report(self, type: str, **extra):
+        self.events.publish(self.user_id, type, [{"id": self.id, "todos": self.todos, "tasks": self.tasks, **extra}])
+
+
+# Импорт NDJSON в формате GET /export: строка - todo со вложенными задачами.
+# Задачи можно передавать и отдельными строками {"todo_list": <id todo из файла>, "note": ...}.
+# Ошибка в любой строке отменяет весь импорт. Ход импорта клиент видит в GET /events: после каждой записи
+# в базу событие import.progress с id импорта и числом загруженных todo и задач (до фиксации транзакции),
+# при ошибке - import.failed. Тот же id возвращается в ответе
+@import_router.post("/import")
+async def import_todos(request: Request, session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]):
+    importer = Importer(session, events, current_user)
+    try:
+        await load_lines(importer, read_lines(request, settings.IMPORT_MAX_LINE_BYTES))
+        await importer.flush(final=True)
+    except HTTPException as e:
+        importer.report("import.failed", detail=e.detail)
+        raise
+    await session.commit()
+    await response_cache.invalidate(current_user)
+    # Строк может быть слишком много для событий, клиенты забирают их через GET /sync
+    events.publish(current_user, "resync", [])
+    return {"id": importer.id, "todos": importer.todos, "tasks": importer.tasks}
+
+
+async def load_lines(importer: Importer, lines):
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("Expected a JSON object")
+            if "todo_list" in row:
+                importer.add_task(TaskCreate.model_validate(row))
+            else:
+                # Todo без id получает внутренний отрицательный id, чтобы к нему привязать вложенные задачи
+                ref = row.get("id", -line_number)
+                importer.add_todo(ref, TODOListCreate.model_validate(row))
+                for task in row.get("tasks", []):
+                    importer.add_task(TaskCreate.model_validate({**task, "todo_list": ref}))
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_number}: {e}")
+        if importer.full:
+            await importer.flush()
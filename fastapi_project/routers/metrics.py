@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+
+from fastapi_project.utils import metrics
+
+
+metrics_router = APIRouter()
+
+
+# Метрики в текстовом формате Prometheus
+@metrics_router.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import delete, tuple_
+from sqlmodel import select
+
+from fastapi_project.config import settings
+from fastapi_project.database import Task, TODOList, Tombstone, SyncResult, SessionDP, utcnow
+from fastapi_project.routers.users import get_current_user
+from fastapi_project.utils.instrumentation import query_budget
+from fastapi_project.utils.pagination import SyncPage, decode_sync_cursor, encode_sync_cursor
+
+
+logger = logging.getLogger(__name__)
+
+sync_router = APIRouter()
+
+# Курсор первой синхронизации
+EPOCH = datetime(1970, 1, 1)
+
+# Разделы ответа в порядке выдачи: клиент применяет удаления раньше строк
+DELETED, TODOS, TASKS = range(3)
+
+
+# Запрос раздела, его время изменения и id. Порядок (время изменения, id) дает ключ для продолжения
+def section_query(section: int, user_id: int):
+    if section == DELETED:
+        return select(Tombstone).where(Tombstone.user==user_id), Tombstone.deleted_at, Tombstone.id
+    if section == TODOS:
+        return select(TODOList).where(TODOList.user==user_id), TODOList.updated_at, TODOList.id
+    query = select(Task).join(TODOList, Task.todo_list==TODOList.id).where(TODOList.user==user_id)
+    return query, Task.updated_at, Task.id
+
+
+# Удаления старше этого времени могли быть стерты prune_tombstones
+def retention_cutoff() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=settings.SYNC_RETENTION_DAYS)
+
+
+# Изменения todo и задач пользователя после курсора since, без since - все его данные.
+# Запросы идут по индексам (user, updated_at), (todo_list, updated_at) и (user, deleted_at),
+# поэтому стоимость зависит от числа изменений, а не от размера аккаунта.
+# Клиент применяет сначала удаления, потом строки, и передает cursor в следующий запрос.
+# Изменения за SYNC_OVERLAP_SECONDS до курсора приходят повторно, их можно узнать по id и version.
+# Удаление todo означает и удаление его задач.
+# За один ответ отдается не больше limit строк и удалений. Если изменений больше, в ответе more и курсор продолжения:
+# клиент повторяет запрос с ним, пока more не станет false. Синхронизация ограничена временем первого запроса,
+# строки, измененные во время обхода, приходят в следующей синхронизации.
+# Удаления хранятся SYNC_RETENTION_DAYS дней, курсор старше получает 410: клиент синхронизируется заново без since
+@sync_router.get("/sync", dependencies=[query_budget(5)])
+async def sync(
+    session: SessionDP,
+    current_user: Annotated[str, Depends(get_current_user)],
+    since: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+) -> SyncResult:
+    since_at, page = decode_sync_cursor(since) if since is not None else (EPOCH, None)
+    if since_at != EPOCH and since_at < retention_cutoff():
+        raise HTTPException(status_code=410, detail="Cursor is older than the deletion history, sync without since")
+    changed_after = max(since_at - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS), EPOCH)
+    if page is None:
+        # При первой синхронизации удалять у клиента нечего
+        until = await session.scalar(select(utcnow()))
+        page = SyncPage(until=until, seen=since_at, section=TODOS if since_at == EPOCH else DELETED)
+
+    rows = {DELETED: [], TODOS: [], TASKS: []}
+    remaining = limit
+    section, position = page.section, (page.changed_at, page.last_id) if page.last_id is not None else None
+    more = False
+    while section <= TASKS:
+        if remaining == 0:
+            more = True
+            break
+        query, changed_at, row_id = section_query(section, current_user)
+        query = query.where(changed_at > changed_after, changed_at <= page.until)
+        if position is not None:
+            query = query.where(tuple_(changed_at, row_id) > tuple_(*position))
+        result = (await session.execute(query.order_by(changed_at, row_id).limit(remaining + 1))).scalars().all()
+        if len(result) > remaining:
+            rows[section] = result[:remaining]
+            last = rows[section][-1]
+            position = (last.deleted_at if section == DELETED else last.updated_at, last.id)
+            more = True
+            break
+        rows[section] = result
+        remaining -= len(result)
+        section, position = section + 1, None
+
+    seen = max([
+        page.seen,
+        *(row.deleted_at for row in rows[DELETED]),
+        *(row.updated_at for row in rows[TODOS]),
+        *(row.updated_at for row in rows[TASKS]),
+    ])
+    if more:
+        position = position or (None, None)
+        cursor = encode_sync_cursor(since_at, SyncPage(page.until, seen, section, *position))
+    else:
+        cursor = encode_sync_cursor(seen)
+    return SyncResult(
+        todos=rows[TODOS],
+        tasks=rows[TASKS],
+        deleted_todos=[row.entity_id for row in rows[DELETED] if row.kind == "todo"],
+        deleted_tasks=[row.entity_id for row in rows[DELETED] if row.kind == "task"],
+        cursor=cursor,
+        more=more,
+    )
+
+
+# Удаляет записи об удалениях старше SYNC_RETENTION_DAYS дней
+async def prune_tombstones(session_factory) -> int:
+    async with session_factory() as session:
+        result = await session.execute(delete(Tombstone).where(Tombstone.deleted_at < retention_cutoff()))
+        await session.commit()
+    return result.rowcount
+
+
+# Фоновая очистка в каждом воркере (startup.py), повторное удаление в нескольких воркерах безвредно.
+# Индекса по одному deleted_at нет, поэтому раз в интервал таблица читается целиком: в ней только удаления за срок хранения
+async def prune_tombstones_periodically(session_factory):
+    while True:
+        await asyncio.sleep(settings.SYNC_PRUNE_SECONDS)
+        try:
+            pruned = await prune_tombstones(session_factory)
+        except Exception:
+            logger.exception("Tombstone pruning failed")
+            continue
+        logger.info("Pruned %s tombstones", pruned)
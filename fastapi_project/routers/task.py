@@ -1,40 +1,198 @@
+from collections import defaultdict, deque
 from typing import Annotated, List
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, Body, Header, HTTPException, Depends, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, delete, insert, update
 from sqlmodel import select
 
-from fastapi_project.database import Task, TODOList, TaskCreate, TaskUpdate, SessionDP
+from fastapi_project.database import Task, TODOList, TaskBatchResult, TaskBatchUpdate, TaskCreate, TaskUpdate, SessionDP, SessionFactoryDP, utcnow
+from fastapi_project.utils.etag import if_match_versions, not_modified, precondition_failed, query_etag, row_etag, rows_etag
+from fastapi_project.utils.events import EventBrokerDP
+from fastapi_project.utils.instrumentation import query_budget
+from fastapi_project.utils.pagination import decode_cursor, decode_rank_cursor, encode_rank_cursor, page_limit, paginate, stream_ndjson
+from fastapi_project.utils.response_cache import ResponseCacheDP
+from fastapi_project.utils.search import search_tasks_query, search_terms
+from fastapi_project.utils.serialization import RowEncoder
 from fastapi_project.routers.users import get_current_user
 
 task_router = APIRouter()
+task_encoder = RowEncoder(Task)
+
+
+# Запрос страницы GET /task без limit. При старте приложения он готовится заранее (startup.py).
+# Один запрос с JOIN вместо отдельного запроса на каждый todo
+def task_page_query(user_id: int, todo_list: int | None = None, after_id: int | None = None):
+    query = select(Task).join(TODOList, Task.todo_list==TODOList.id).where(TODOList.user==user_id)
+    if todo_list is not None:
+        query = query.where(Task.todo_list==todo_list)
+    if after_id is not None:
+        query = query.where(Task.id > after_id)
+    return query.order_by(Task.id)
 
 
 # Получение списка задач
-@task_router.get("/task")
-async def get_tasks(session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> List[Task]:
-    todo_list = await session.execute(select(TODOList).where(TODOList.user==current_user))
-    tasks = []
-    for todo in todo_list.scalars().all():
-        task = await session.execute(select(Task).where(Task.todo_list==todo.id))
-        tasks.extend(task.scalars().all())
-    return tasks
+@task_router.get("/task", dependencies=[query_budget(3)])
+async def get_tasks(
+    session: SessionDP,
+    session_factory: SessionFactoryDP,
+    response_cache: ResponseCacheDP,
+    current_user: Annotated[str, Depends(get_current_user)],
+    todo_list: int | None = None,
+    after: str | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=1000)] = None,
+    stream: bool = False,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> List[Task]:
+    # Пагинация по ключу: after - курсор из заголовка X-Next-Cursor
+    query = task_page_query(current_user, todo_list, decode_cursor(after) if after is not None else None)
+    if stream:
+        return StreamingResponse(stream_ndjson(session_factory, query), media_type="application/x-ndjson")
+    limit = page_limit(limit, after)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    resource = f"task?todo_list={todo_list}&after={after}&limit={limit}"
+    if if_none_match is not None:
+        if unchanged := not_modified(if_none_match, await query_etag(session, resource, query, Task)):
+            return unchanged
+
+    # При LIST_ENCODER "rows" и "orjson" - кортежи колонок вместо ORM-объектов, JSON собирается без Pydantic
+    async def load():
+        tasks = task_encoder.rows((await session.execute(query.with_only_columns(*task_encoder.selection))).all())
+        etag = rows_etag(resource, tasks)
+        tasks, headers = paginate(tasks, limit)
+        return task_encoder.body(tasks), {**headers, "ETag": etag}
+
+    return await response_cache.response(current_user, resource, load)
+
+
+# Полнотекстовый поиск по задачам пользователя, лучшие совпадения первыми.
+# after - курсор из заголовка X-Next-Cursor
+@task_router.get("/task/search", dependencies=[query_budget(2)])
+async def search_tasks(
+    session: SessionDP,
+    response_cache: ResponseCacheDP,
+    current_user: Annotated[str, Depends(get_current_user)],
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    after: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> List[Task]:
+    terms = search_terms(q)
+    columns = task_encoder.selection
+    query = search_tasks_query(
+        session.bind.dialect.name, current_user, terms, columns, limit + 1, decode_rank_cursor(after) if after is not None else None,
+    )
+
+    async def load():
+        # Запрос без слов (только знаки препинания) ничего не находит
+        rows = (await session.execute(query)).all() if terms else []
+        # Колонки ранга после колонок задачи кодировщик пропускает
+        tasks = task_encoder.rows(rows)
+        headers = {}
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            headers = {"X-Next-Cursor": encode_rank_cursor(list(rows[limit - 1][len(columns):]), tasks[-1].id)}
+        return task_encoder.body(tasks), headers
+
+    return await response_cache.response(current_user, f"task/search?q={' '.join(terms)}&after={after}&limit={limit}", load)
+
+
+# Пакетные операции над задачами: владелец проверяется одним запросом на весь пакет,
+# запись идет одной транзакцией, результат возвращается для каждого элемента
+@task_router.post("/task/batch", dependencies=[query_budget(3)])
+async def create_tasks(tasks: Annotated[List[TaskCreate], Body(max_length=1000)], session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> List[TaskBatchResult]:
+    owned = await session.execute(
+        select(TODOList.id).where(TODOList.id.in_({task.todo_list for task in tasks}), TODOList.user==current_user)
+    )
+    owned = set(owned.scalars().all())
+    rows = [{"todo_list": task.todo_list, "note": task.note} for task in tasks if task.todo_list in owned]
+    # Порядок строк в RETURNING не гарантирован, поэтому созданные задачи
+    # сопоставляются с элементами запроса по содержимому
+    created = defaultdict(deque)
+    if rows:
+        result = await session.scalars(insert(Task).returning(Task), rows)
+        result = result.all()
+        for task in result:
+            created[task.todo_list, task.note].append(task)
+        await session.commit()
+        await response_cache.invalidate(current_user)
+        events.publish(current_user, "task.created", result)
+    return [
+        TaskBatchResult(index=i, status=200, task=created[task.todo_list, task.note].popleft()) if task.todo_list in owned
+        else TaskBatchResult(index=i, status=400, detail="Unknown todo list")
+        for i, task in enumerate(tasks)
+    ]
+
+
+@task_router.patch("/task/batch", dependencies=[query_budget(2)])
+async def update_tasks(tasks: Annotated[List[TaskBatchUpdate], Body(max_length=1000)], session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> List[TaskBatchResult]:
+    # Одним UPDATE ... RETURNING: новые тексты выбираются по id через CASE, владелец проверяется подзапросом.
+    # Повторный id в пакете получает последний текст
+    notes = {task.id: task.note for task in tasks}
+    result = await session.execute(
+        update(Task)
+        .where(Task.id.in_(notes), Task.todo_list.in_(select(TODOList.id).where(TODOList.user==current_user)))
+        .values(note=case(notes, value=Task.id), version=Task.version + 1, updated_at=utcnow())
+        .returning(Task)
+        .execution_options(synchronize_session=False)
+    )
+    updated = {task.id: task for task in result.scalars().all()}
+    if updated:
+        await session.commit()
+        await response_cache.invalidate(current_user)
+        events.publish(current_user, "task.updated", list(updated.values()))
+    return [
+        TaskBatchResult(index=i, status=200, task=updated[task.id]) if task.id in updated
+        else TaskBatchResult(index=i, status=404, detail="Task not found")
+        for i, task in enumerate(tasks)
+    ]
+
+
+@task_router.delete("/task/batch", dependencies=[query_budget(2)])
+async def delete_tasks(task_ids: Annotated[List[int], Body(max_length=1000)], session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> List[TaskBatchResult]:
+    deleted = await session.execute(
+        delete(Task)
+        .where(Task.id.in_(set(task_ids)), Task.todo_list.in_(select(TODOList.id).where(TODOList.user==current_user)))
+        .returning(Task.id)
+    )
+    deleted = set(deleted.scalars().all())
+    await session.commit()
+    if deleted:
+        await response_cache.invalidate(current_user)
+        events.publish(current_user, "task.deleted", [{"id": task_id} for task_id in sorted(deleted)])
+    return [
+        TaskBatchResult(index=i, status=200) if task_id in deleted
+        else TaskBatchResult(index=i, status=404, detail="Task not found")
+        for i, task_id in enumerate(task_ids)
+    ]
 
 
 # Получение конкретной задачи
-@task_router.get("/task/{task_id}")
-async def get_task(task_id: int, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> Task:
-    task = await session.get(Task, task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    todo_id = await session.get(TODOList, task.todo_list)
-    if not task or todo_id.user != current_user or not todo_id:
-        raise HTTPException(status_code=404, detail="Task not found")
-    return task
+@task_router.get("/task/{task_id}", dependencies=[query_budget(4)])
+async def get_task(task_id: int, session: SessionDP, response_cache: ResponseCacheDP, current_user: Annotated[str, Depends(get_current_user)], if_none_match: Annotated[str | None, Header()] = None) -> Task:
+    if if_none_match is not None:
+        result = await session.execute(
+            select(Task.id, Task.version).join(TODOList, Task.todo_list==TODOList.id).where(Task.id==task_id, TODOList.user==current_user)
+        )
+        task = result.first()
+        if task and (unchanged := not_modified(if_none_match, row_etag(task))):
+            return unchanged
+
+    async def load():
+        task = await session.get(Task, task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        todo_id = await session.get(TODOList, task.todo_list)
+        if not task or todo_id.user != current_user or not todo_id:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return task, {"ETag": row_etag(task)}
+
+    return await response_cache.response(current_user, f"task/{task_id}", load)
 
 
 # Создание задачи
-@task_router.post("/task")
-async def create_task(task: TaskCreate, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> Task:
+@task_router.post("/task", dependencies=[query_budget(4)])
+async def create_task(task: TaskCreate, session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> Task:
     todo_id = await session.get(TODOList, task.todo_list)
     if not todo_id or todo_id.user != current_user:
         raise HTTPException(status_code=400, detail="Unknown todo list")
@@ -42,35 +200,49 @@ async def create_task(task: TaskCreate, session: SessionDP, current_user: Annota
     session.add(task)
     await session.commit()
     await session.refresh(task)
+    await response_cache.invalidate(current_user)
+    events.publish(current_user, "task.created", [task])
     return task
 
 
-# Обновление задачи
-@task_router.put("/task/{task_id}")
-async def update_task(task_id: int, new_task: TaskUpdate, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> Task:
-    old_task: Task = await session.get(Task, task_id)
-    if not old_task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    todo_id = await session.get(TODOList, old_task.todo_list)
-    if not old_task or todo_id.user != current_user:
+# Обновление задачи, If-Match как у PUT /todo/{todo_id}
+@task_router.put("/task/{task_id}", dependencies=[query_budget(3)])
+async def update_task(task_id: int, new_task: TaskUpdate, session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, response: Response, current_user: Annotated[str, Depends(get_current_user)], if_match: Annotated[str | None, Header()] = None) -> Task:
+    # Проверка владельца в том же UPDATE ... FROM todolist: один запрос вместо get, get, commit и refresh
+    owned = (Task.id==task_id, Task.todo_list==TODOList.id, TODOList.user==current_user)
+    query = update(Task).where(*owned)
+    versions = if_match_versions(if_match, task_id)
+    if versions is not None:
+        query = query.where(Task.version.in_(versions))
+    result = await session.execute(
+        query
+        .values(**new_task.model_dump(exclude_unset=True), version=Task.version + 1, updated_at=utcnow())
+        .returning(Task)
+        .execution_options(synchronize_session=False)
+    )
+    task = result.scalars().first()
+    if not task:
+        if versions is not None and await session.scalar(select(Task.id).where(*owned)):
+            raise precondition_failed()
         raise HTTPException(status_code=404, detail="Task not found")
-    task_data = new_task.model_dump(exclude_unset=True)
-    old_task.sqlmodel_update(task_data)
-    session.add(old_task)
     await session.commit()
-    await session.refresh(old_task)
-    return old_task
+    await response_cache.invalidate(current_user)
+    events.publish(current_user, "task.updated", [task])
+    response.headers["ETag"] = row_etag(task)
+    return task
 
 
 # Удаление задачи
-@task_router.delete("/task/{task_id}")
-async def delete_task(task_id: int, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> Task:
-    task: Task = await session.get(Task, task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    todo_id = await session.get(TODOList, task.todo_list)
-    if not task or todo_id.user != current_user:
+@task_router.delete("/task/{task_id}", dependencies=[query_budget(2)])
+async def delete_task(task_id: int, session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> Task:
+    result = await session.execute(
+        delete(Task)
+        .where(Task.id==task_id, Task.todo_list.in_(select(TODOList.id).where(TODOList.user==current_user)))
+        .returning(Task.id)
+    )
+    if not result.scalars().first():
         raise HTTPException(status_code=404, detail="Task not found")
-    await session.delete(task)
     await session.commit()
+    await response_cache.invalidate(current_user)
+    events.publish(current_user, "task.deleted", [{"id": task_id}])
     return {"msg": "Task deleted successfully"}
@@ -1,64 +1,137 @@
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
-from fastapi_project.database import Task, TODOList, TODOListCreate, SessionDP
+from fastapi_project.database import Task, TODOList, TODOListCreate, SessionDP, SessionFactoryDP, utcnow
+from fastapi_project.utils.bulk import insert_or_ignore
+from fastapi_project.utils.etag import if_match_versions, not_modified, precondition_failed, query_etag, row_etag, rows_etag
+from fastapi_project.utils.events import EventBrokerDP
+from fastapi_project.utils.instrumentation import query_budget
+from fastapi_project.utils.pagination import decode_cursor, page_limit, paginate, stream_ndjson
+from fastapi_project.utils.response_cache import ResponseCacheDP
+from fastapi_project.utils.serialization import RowEncoder
 from fastapi_project.routers.users import get_current_user
 
 
 todo_router = APIRouter()
+todo_encoder = RowEncoder(TODOList)
+
+
+# Запрос страницы GET /todo без limit. При старте приложения он готовится заранее (startup.py)
+def todo_page_query(user_id: int, after_id: int | None = None):
+    query = select(TODOList).where(TODOList.user==user_id)
+    if after_id is not None:
+        query = query.where(TODOList.id > after_id)
+    return query.order_by(TODOList.id)
 
 
 # Получение списка todo
-@todo_router.get("/todo")
-async def get_todolists(session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> List[TODOList]:
-    todo = await session.execute(select(TODOList).where(TODOList.user==current_user))
-    return todo.scalars().all()
+@todo_router.get("/todo", dependencies=[query_budget(3)])
+async def get_todolists(
+    session: SessionDP,
+    session_factory: SessionFactoryDP,
+    response_cache: ResponseCacheDP,
+    current_user: Annotated[str, Depends(get_current_user)],
+    after: str | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=1000)] = None,
+    stream: bool = False,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> List[TODOList]:
+    query = todo_page_query(current_user, decode_cursor(after) if after is not None else None)
+    if stream:
+        return StreamingResponse(stream_ndjson(session_factory, query), media_type="application/x-ndjson")
+    limit = page_limit(limit, after)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    resource = f"todo?after={after}&limit={limit}"
+    # Клиент с актуальной страницей получает 304 после одного агрегирующего запроса
+    if if_none_match is not None:
+        if unchanged := not_modified(if_none_match, await query_etag(session, resource, query, TODOList)):
+            return unchanged
+
+    # При LIST_ENCODER "rows" и "orjson" - кортежи колонок вместо ORM-объектов, JSON собирается без Pydantic
+    async def load():
+        todo = todo_encoder.rows((await session.execute(query.with_only_columns(*todo_encoder.selection))).all())
+        etag = rows_etag(resource, todo)
+        todo, headers = paginate(todo, limit)
+        return todo_encoder.body(todo), {**headers, "ETag": etag}
+
+    return await response_cache.response(current_user, resource, load)
 
 
 # Получение конкретного todo
-@todo_router.get("/todo/{todo_id}")
-async def get_todolist(todo_id: int, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> TODOList:
-    todo = await session.get(TODOList, todo_id)
-    if not todo or todo.user != current_user:
-        raise HTTPException(status_code=404, detail="Todo not found")
-    return todo
+@todo_router.get("/todo/{todo_id}", dependencies=[query_budget(3)])
+async def get_todolist(todo_id: int, session: SessionDP, response_cache: ResponseCacheDP, current_user: Annotated[str, Depends(get_current_user)], if_none_match: Annotated[str | None, Header()] = None) -> TODOList:
+    if if_none_match is not None:
+        result = await session.execute(select(TODOList.id, TODOList.version).where(TODOList.id==todo_id, TODOList.user==current_user))
+        todo = result.first()
+        if todo and (unchanged := not_modified(if_none_match, row_etag(todo))):
+            return unchanged
+
+    async def load():
+        todo = await session.get(TODOList, todo_id)
+        if not todo or todo.user != current_user:
+            raise HTTPException(status_code=404, detail="Todo not found")
+        return todo, {"ETag": row_etag(todo)}
+
+    return await response_cache.response(current_user, f"todo/{todo_id}", load)
 
 
 # Создание todo
-@todo_router.post("/todo")
-async def create_task(todo: TODOListCreate, current_user: Annotated[str, Depends(get_current_user)], session: SessionDP) -> TODOList:
-    result = await session.execute(select(TODOList).where(TODOList.title==todo.title))
-    existing_todo = result.scalars().first()
-    if existing_todo:
+@todo_router.post("/todo", dependencies=[query_budget(2)])
+async def create_task(todo: TODOListCreate, current_user: Annotated[str, Depends(get_current_user)], session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP) -> TODOList:
+    # Уникальность (user, title) проверяет база: при конфликте RETURNING не вернет строку
+    query = insert_or_ignore(session, TODOList, ["user", "title"]).values(user=current_user, title=todo.title).returning(TODOList)
+    result = await session.execute(query)
+    new_todo = result.scalars().first()
+    if not new_todo:
         raise HTTPException(status_code=400, detail="Todo with this title already exists")
-    todo = TODOList(user=current_user, title=todo.title)
-    session.add(todo)
     await session.commit()
-    await session.refresh(todo)
-    return todo
+    await response_cache.invalidate(current_user)
+    events.publish(current_user, "todo.created", [new_todo])
+    return new_todo
 
 
-# Обновление todo
-@todo_router.put("/todo/{todo_id}")
-async def update_task(todo_id: int, new_todo: TODOListCreate, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> TODOList:
-    old_todo: TODOList = await session.get(TODOList, todo_id)
-    if not old_todo or old_todo.user != current_user:
+# Обновление todo. If-Match с ETag из GET защищает от перезаписи чужих изменений: при другой версии 412
+@todo_router.put("/todo/{todo_id}", dependencies=[query_budget(3)])
+async def update_task(todo_id: int, new_todo: TODOListCreate, session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, response: Response, current_user: Annotated[str, Depends(get_current_user)], if_match: Annotated[str | None, Header()] = None) -> TODOList:
+    query = update(TODOList).where(TODOList.id==todo_id, TODOList.user==current_user)
+    versions = if_match_versions(if_match, todo_id)
+    if versions is not None:
+        query = query.where(TODOList.version.in_(versions))
+    try:
+        result = await session.execute(
+            query
+            .values(**new_todo.model_dump(exclude_unset=True), version=TODOList.version + 1, updated_at=utcnow())
+            .returning(TODOList)
+            .execution_options(synchronize_session=False)
+        )
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Todo with this title already exists")
+    todo = result.scalars().first()
+    if not todo:
+        # Второй запрос только при неудаче: отличить чужую версию от отсутствующего todo
+        if versions is not None and await session.scalar(select(TODOList.id).where(TODOList.id==todo_id, TODOList.user==current_user)):
+            raise precondition_failed()
         raise HTTPException(status_code=404, detail="Todo not found")
-    todo_data = new_todo.model_dump(exclude_unset=True)
-    old_todo.sqlmodel_update(todo_data)
-    session.add(old_todo)
     await session.commit()
-    await session.refresh(old_todo)
-    return old_todo
+    await response_cache.invalidate(current_user)
+    events.publish(current_user, "todo.updated", [todo])
+    response.headers["ETag"] = row_etag(todo)
+    return todo
 
 
 # Удаление todo
-@todo_router.delete("/todo/{todo_id}")
-async def delete_todo(todo_id: int, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]) -> TODOList:
-    todo: TODOList = await session.get(TODOList, todo_id)
-    if not todo or todo.user != current_user:
+@todo_router.delete("/todo/{todo_id}", dependencies=[query_budget(2)])
+async def delete_todo(todo_id: int, session: SessionDP, response_cache: ResponseCacheDP, events: EventBrokerDP, current_user: Annotated[str, Depends(get_current_user)]) -> TODOList:
+    # Задачи удаляет база по ON DELETE CASCADE
+    result = await session.execute(delete(TODOList).where(TODOList.id==todo_id, TODOList.user==current_user).returning(TODOList.id))
+    if not result.scalars().first():
         raise HTTPException(status_code=404, detail="Todo not found")
-    await session.delete(todo)
     await session.commit()
+    await response_cache.invalidate(current_user)
+    events.publish(current_user, "todo.deleted", [{"id": todo_id}])
     return {"msg": "Todo deleted successfully"}
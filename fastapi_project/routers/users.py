@@ -1,19 +1,39 @@
+import time
 from datetime import timezone, datetime
 from typing import Annotated, List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import jwt
+from sqlalchemy import delete
 from sqlmodel import select
-from fastapi_project.database import User, SessionDP, UserRead, UserRegister
+from fastapi_project.database import User, SessionDP, utcnow, UserRead, UserRegister, UserPasswordUpdate
 from fastapi_project.config import settings
+from fastapi_project.utils.cache import TTLCache
+from fastapi_project.utils.hashing import HashingPool
+from fastapi_project.utils.instrumentation import query_budget
+from fastapi_project.utils.metrics import Counter, Gauge
+from fastapi_project.utils.rate_limit import limit_ip, rate_limiter
+from fastapi_project.utils.replica import read_router
+from fastapi_project.utils.response_cache import ResponseCacheDP
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+hashing_pool = HashingPool(workers=settings.HASH_WORKERS, max_queue=settings.HASH_MAX_QUEUE)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Кэш проверенных токенов (token -> (user id, имя, gen)) и данных пользователей (user id -> (имя, gen)),
+# чтобы не ходить в базу на каждый авторизованный запрос. Токен сверяется с данными пользователя при каждом запросе:
+# после смены пароля или удаления пользователя токен перестает действовать в этом воркере сразу,
+# в остальных - когда истечет запись user_cache (AUTH_CACHE_TTL)
+token_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+user_cache = TTLCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+auth_cache_requests = Counter("auth_cache_requests_total", "Auth cache lookups", ("cache", "result"))
+auth_cache_hit_ratio = Gauge("auth_cache_hit_ratio", "Auth cache hit ratio", ("cache",))
+
 user_router = APIRouter()
 
 
@@ -27,26 +47,71 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], session: SessionDP):
+def record_cache_lookup(cache: str, hit: bool):
+    auth_cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+    hits = auth_cache_requests.value(cache=cache, result="hit")
+    misses = auth_cache_requests.value(cache=cache, result="miss")
+    auth_cache_hit_ratio.set(hits / (hits + misses), cache=cache)
+
+# Данные токена. gen - время регистрации или последней смены пароля: токен, выданный до смены пароля,
+# или токен удаленного пользователя, чей id SQLite выдал новому, с данными пользователя не совпадет
+def access_token_data(user_id: int, username: str, password_changed_at: datetime) -> dict:
+    return {"sub": username, "uid": user_id, "gen": password_changed_at.isoformat()}
+
+def invalidate_user(user_id: int):
+    user_cache.pop(user_id)
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    
-    result = await session.execute(select(User).where(User.username==username))
-    user = result.scalars().first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user.id
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Данные проверенного токена: (user id, имя, gen) из кэша токенов или из подписанного JWT.
+# FastAPI вызывает зависимость один раз за запрос, limit_user и get_current_user получают один результат
+async def get_token_claims(token: Annotated[str, Depends(oauth2_scheme)]) -> tuple[int, str, str]:
+    claims = token_cache.get(token)
+    record_cache_lookup("token", claims is not None)
+    if claims is None:
+        payload = decode_token(token)
+        # Токены, выданные до появления gen, проверить нельзя, с ними нужно войти заново
+        if not isinstance(payload.get("uid"), int) or payload.get("gen") is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        claims = (payload["uid"], payload["sub"], payload["gen"])
+        # Запись в кэше не должна пережить сам токен
+        token_cache.set(token, claims, ttl=payload["exp"] - time.time())
+    return claims
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_current_user(claims: Annotated[tuple[int, str, str], Depends(get_token_claims)], session: SessionDP):
+    user_id, username, generation = claims
+    credentials = user_cache.get(user_id)
+    record_cache_lookup("user", credentials is not None)
+    if credentials is None:
+        result = await session.execute(select(User.username, User.password_changed_at).where(User.id==user_id))
+        row = result.first()
+        if row is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        credentials = (row.username, row.password_changed_at.isoformat())
+        user_cache.set(user_id, credentials)
+    if credentials != (username, generation):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user_id
+
+# Ограничение частоты запросов пользователя, у каждого маршрута своя корзина. Пользователь определяется по токену
+# без сессии базы, поэтому лишние запросы отсекаются раньше, чем займут место в ограничителе сессий
+# и соединение пула. Совпадение токена с данными пользователя проверит get_current_user
+async def limit_user(request: Request, claims: Annotated[tuple[int, str, str], Depends(get_token_claims)]):
+    route = f"{request.method} {request.scope['route'].path}"
+    await rate_limiter.hit("user", f"{claims[0]}:{route}", settings.RATE_LIMIT_USER_RATE, settings.RATE_LIMIT_USER_BURST)
+
+async def verify_password(plain_password, hashed_password):
+    return await hashing_pool.run(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash(password):
+    return await hashing_pool.run(pwd_context.hash, password)
 
 def get_user(id: int, session: SessionDP) -> User:
     user = session.get(User, id)
@@ -54,31 +119,60 @@ def get_user(id: int, session: SessionDP) -> User:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
-@user_router.post("/register")
+@user_router.post("/register", dependencies=[Depends(limit_ip), query_budget(3)])
 async def register(user: UserRegister, session: SessionDP):
     result = await session.execute(select(User).where(User.username==user.username))
     old_user = result.scalars().first()
     if old_user:
         raise HTTPException(status_code=400, detail="User already exists")
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     new_user = User(username=user.username, password=hashed_password)
     session.add(new_user)
     await session.commit()
     await session.refresh(new_user)
+    # Токена при регистрации нет, поэтому окно чтения из основной базы открывается здесь:
+    # первые запросы нового пользователя не должны попасть в реплику, где его еще нет
+    await read_router.mark_write(new_user.id)
     return {"msg": "User registered successfully"}
 
-@user_router.post("/login")
+@user_router.post("/login", dependencies=[Depends(limit_ip), query_budget(1)])
 async def login(user: UserRegister, session: SessionDP):
     result = await session.execute(select(User).where(User.username==user.username))
     login_user = result.scalars().first()
-    if not login_user or not verify_password(user.password, login_user.password):
+    if not login_user or not await verify_password(user.password, login_user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    access_token = create_access_token(data={"sub": user.username}, expires_delta=timedelta(minutes=float(settings.ACCESS_TOKEN_EXPIRE_MINUTES)))
+    data = access_token_data(login_user.id, login_user.username, login_user.password_changed_at)
+    # Данные только что прочитаны из базы: запись, оставшаяся от удаленного пользователя с тем же id, заменяется
+    user_cache.set(login_user.id, (data["sub"], data["gen"]))
+    access_token = create_access_token(data=data, expires_delta=timedelta(minutes=float(settings.ACCESS_TOKEN_EXPIRE_MINUTES)))
     return {"access_token": access_token, "token_type": "bearer"}
 
-@user_router.get("/users/me")
+@user_router.get("/users/me", dependencies=[Depends(limit_user), query_budget(2)])
 async def read_users_me(session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]):
     result = await get_user(current_user, session)
     user = UserRead.from_orm(result)
-    return user
\ No newline at end of file
+    return user
+
+@user_router.put("/users/me/password", dependencies=[Depends(limit_user), query_budget(3)])
+async def change_password(passwords: UserPasswordUpdate, session: SessionDP, current_user: Annotated[str, Depends(get_current_user)]):
+    user = await session.get(User, current_user)
+    if not await verify_password(passwords.old_password, user.password):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    user.password = await get_password_hash(passwords.new_password)
+    # Новое время смены пароля отменяет все выданные токены
+    user.password_changed_at = utcnow()
+    session.add(user)
+    await session.commit()
+    invalidate_user(current_user)
+    return {"msg": "Password changed successfully"}
+
+@user_router.delete("/users/me", dependencies=[Depends(limit_user), query_budget(2)])
+async def delete_user(session: SessionDP, response_cache: ResponseCacheDP, current_user: Annotated[str, Depends(get_current_user)]):
+    # todo и задачи пользователя удаляет база по ON DELETE CASCADE
+    await session.execute(delete(User).where(User.id==current_user))
+    await session.commit()
+    invalidate_user(current_user)
+    # id удаленного пользователя может достаться новому, его ответы не должны быть видны
+    await response_cache.invalidate(current_user)
+    return {"msg": "User deleted successfully"}
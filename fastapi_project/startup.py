@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from sqlalchemy import QueuePool, inspect
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlmodel import SQLModel, select
+
+from fastapi_project import database
+from fastapi_project.config import settings
+from fastapi_project.database import Task, TODOList, User
+from fastapi_project.routers.sync import prune_tombstones_periodically
+from fastapi_project.routers.task import task_encoder, task_page_query
+from fastapi_project.routers.todo import todo_encoder, todo_page_query
+from fastapi_project.utils.events import event_broker
+from fastapi_project.utils.metrics import Gauge
+from fastapi_project.utils.rate_limit import rate_limiter
+from fastapi_project.utils.replica import read_router
+from fastapi_project.utils.response_cache import response_cache
+from fastapi_project.utils.serialization import check_list_encoder
+
+
+logger = logging.getLogger(__name__)
+
+startup_seconds = Gauge("app_startup_seconds", "Time spent in each startup phase, ready is the total", ("phase",))
+
+
+class SchemaError(Exception):
+    pass
+
+
+# Горячие запросы: авторизация, GET /todo, GET /task и GET /task/{task_id}.
+# Выполнение на каждом прогретом соединении заполняет кэш компиляции SQLAlchemy
+# и кэш подготовленных выражений asyncpg этого соединения
+def hot_statements() -> list:
+    return [
+        select(User).where(User.id==0),
+        select(TODOList).where(TODOList.id==0),
+        select(Task).where(Task.id==0),
+        todo_page_query(0).with_only_columns(*todo_encoder.selection).limit(1),
+        task_page_query(0).with_only_columns(*task_encoder.selection).limit(1),
+    ]
+
+
+# Все таблицы и колонки моделей есть в базе. Схемой управляет Alembic, приложение ее не меняет
+async def verify_schema(engine: AsyncEngine):
+    def missing(conn) -> list[str]:
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+        problems = []
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in tables:
+                problems.append(table.name)
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            problems.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in columns)
+        return problems
+
+    async with engine.connect() as conn:
+        problems = await conn.run_sync(missing)
+    if problems:
+        raise SchemaError(f"Database schema is out of date, missing {', '.join(problems)}. Run alembic upgrade head")
+
+
+# Открывает до connections соединений одновременно и возвращает их в пул.
+# Соединений больше pool_size пул не хранит, поэтому их число ограничено размером пула
+async def warm_up_pool(engine: AsyncEngine, connections: int, prime: bool = True) -> int:
+    if isinstance(engine.pool, QueuePool):
+        connections = min(connections, engine.pool.size())
+    statements = hot_statements() if prime else []
+
+    async def open_connection() -> AsyncConnection:
+        conn = await engine.connect()
+        for statement in statements:
+            await conn.execute(statement)
+        return conn
+
+    opened = await asyncio.gather(*(open_connection() for _ in range(connections)), return_exceptions=True)
+    for conn in opened:
+        if isinstance(conn, AsyncConnection):
+            await conn.close()
+    errors = [conn for conn in opened if isinstance(conn, BaseException)]
+    if errors:
+        raise errors[0]
+    return connections
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI, started: float | None = None):
+    """Подготовка приложения до первого запроса.
+
+    started - perf_counter в начале импорта приложения (main.py), от него считается время до готовности.
+    Этапы: проверка или создание схемы (STARTUP_SCHEMA), прогрев пулов основной базы и реплики, подготовка горячих запросов
+    (DB_WARMUP_CONNECTIONS), подключение брокера событий. Длительность этапов пишется в метрику app_startup_seconds и в журнал.
+    До остановки приложения в фоне удаляются устаревшие записи об удалениях (SYNC_PRUNE_SECONDS).
+    """
+    started = started if started is not None else time.perf_counter()
+    check_list_encoder()
+    phase_started = time.perf_counter()
+    if settings.STARTUP_SCHEMA == "create":
+        await database.create_db_and_tables()
+    elif settings.STARTUP_SCHEMA == "verify":
+        await verify_schema(database.engine)
+    startup_seconds.set(time.perf_counter() - phase_started, phase="schema")
+
+    phase_started = time.perf_counter()
+    warmed = await warm_up_pool(database.engine, settings.DB_WARMUP_CONNECTIONS) if settings.DB_WARMUP_CONNECTIONS else 0
+    if database.replica_engine is not None and settings.DB_WARMUP_CONNECTIONS:
+        warmed += await warm_up_pool(database.replica_engine, settings.DB_WARMUP_CONNECTIONS)
+    startup_seconds.set(time.perf_counter() - phase_started, phase="warmup")
+
+    await event_broker.start()
+    pruning = None
+    if settings.SYNC_PRUNE_SECONDS:
+        pruning = asyncio.create_task(prune_tombstones_periodically(database.async_session))
+
+    ready = time.perf_counter() - started
+    startup_seconds.set(ready, phase="ready")
+    logger.info(
+        "Ready in %.3fs: import %.3fs, schema %.3fs, %d connections warmed in %.3fs",
+        ready, startup_seconds.value(phase="import"), startup_seconds.value(phase="schema"),
+        warmed, startup_seconds.value(phase="warmup"),
+    )
+    yield
+    if pruning is not None:
+        pruning.cancel()
+    await event_broker.close()
+    await response_cache.backend.close()
+    await rate_limiter.buckets.close()
+    await read_router.marks.close()
+    await database.engine.dispose()
+    if database.replica_engine is not None:
+        await database.replica_engine.dispose()
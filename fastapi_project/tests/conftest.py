@@ -1,24 +1,53 @@
+from contextlib import contextmanager
+
+import pytest
 import pytest_asyncio
+from sqlalchemy import event
 from sqlmodel import SQLModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 
 from fastapi_project.config import settings
-from fastapi_project.database import get_session
+from fastapi_project.database import get_session_factory, make_engine
 from fastapi_project.main import app
 
 
 test_db_url = settings.TEST_DB_URL
-engine = create_async_engine(test_db_url)
+engine = make_engine(test_db_url)
 
 TestSession = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
-async def override_get_db():
-    async with TestSession() as db:
-        yield db
-
 # Переписываем зависимость, через которую app обращается к базе
-app.dependency_overrides[get_session] = override_get_db
+app.dependency_overrides[get_session_factory] = lambda: TestSession
+
+# Маршрут, превысивший бюджет SQL-запросов, роняет тест
+settings.QUERY_BUDGET_MODE = "error"
+# Тесты делают много запросов подряд, ограничение частоты проверяет только test_rate_limit
+settings.RATE_LIMIT_USER_RATE = 0
+settings.RATE_LIMIT_IP_RATE = 0
+
+
+# Тексты SQL-запросов, выполненных внутри блока:
+#     with count_queries(1) as statements:
+#         response = await client.get(...)
+# С числом в аргументе блок проверяет, что запросов было ровно столько
+@pytest.fixture
+def count_queries():
+    @contextmanager
+    def counter(expected: int | None = None):
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+        try:
+            yield statements
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count_statement)
+        assert expected is None or len(statements) == expected, statements
+
+    return counter
 
 
 # Настройка базы данных
@@ -0,0 +1,35 @@
+from sqlalchemy import Insert, Table, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import SQLModel
+
+
+# Массовая вставка строк в текущей транзакции сессии: COPY на PostgreSQL (asyncpg),
+# executemany пачками по chunk_size строк на остальных базах
+async def copy_rows(session: AsyncSession, table: Table, columns: list[str], rows: list[tuple], chunk_size: int = 5000):
+    if not rows:
+        return
+    conn = await session.connection()
+    if conn.dialect.driver == "asyncpg":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            table.name, records=rows, columns=columns, schema_name=table.schema
+        )
+        return
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        await conn.execute(insert(table), [dict(zip(columns, row)) for row in chunk])
+
+
+# Многострочный INSERT ... RETURNING id, id возвращаются в порядке переданных строк
+async def insert_returning_ids(session: AsyncSession, model: type[SQLModel], rows: list[dict]) -> list[int]:
+    if not rows:
+        return []
+    result = await session.execute(insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+    return result.scalars().all()
+
+
+# INSERT ... ON CONFLICT DO NOTHING. Конструкция своя у каждого диалекта, синтаксис у PostgreSQL и SQLite общий
+def insert_or_ignore(session: AsyncSession, model: type[SQLModel], index_elements: list[str]) -> Insert:
+    dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing(index_elements=index_elements)
@@ -0,0 +1,73 @@
+import hashlib
+
+from fastapi import HTTPException, Response
+from sqlalchemy import Select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import SQLModel, select
+
+
+# Сильный ETag строки: id и версия
+def row_etag(row: SQLModel) -> str:
+    return f'"{row.id}-{row.version}"'
+
+
+# Слабый ETag страницы из числа строк, наибольшего id, суммы версий и времени последнего изменения.
+# Вставка меняет число строк и max(id), изменение строки - сумму версий и max(updated_at), удаление - число строк.
+# key отличает страницы с разными параметрами
+def page_etag(key: str, count: int, max_id: int | None, versions: int | None, updated_at) -> str:
+    state = f"{key}:{count}:{max_id}:{versions}:{updated_at.isoformat() if updated_at else None}"
+    return f'W/"{hashlib.blake2b(state.encode(), digest_size=8).hexdigest()}"'
+
+
+def rows_etag(key: str, rows: list[SQLModel]) -> str:
+    return page_etag(
+        key,
+        len(rows),
+        max((row.id for row in rows), default=None),
+        sum(row.version for row in rows) if rows else None,
+        max((row.updated_at for row in rows), default=None),
+    )
+
+
+# Тот же ETag одним агрегирующим запросом по странице, без чтения и сериализации строк
+async def query_etag(session: AsyncSession, key: str, query: Select, model: type[SQLModel]) -> str:
+    page = query.with_only_columns(model.id, model.version, model.updated_at).subquery()
+    result = await session.execute(
+        select(func.count(), func.max(page.c.id), func.sum(page.c.version), func.max(page.c.updated_at))
+    )
+    return page_etag(key, *result.one())
+
+
+def _etags(header: str) -> list[str]:
+    return [tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()]
+
+
+# If-None-Match сравнивается слабо: W/"x" совпадает с "x"
+def not_modified(if_none_match: str | None, etag: str) -> Response | None:
+    if if_none_match is None:
+        return None
+    tags = _etags(if_none_match)
+    if "*" in tags or etag.removeprefix("W/") in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+
+# Версии строки из сильных ETag заголовка If-Match. None - условия нет (заголовка нет или "*")
+def if_match_versions(if_match: str | None, row_id: int) -> list[int] | None:
+    if if_match is None:
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return None
+        # Слабые ETag для If-Match не подходят
+        if tag.startswith('"') and tag.endswith('"'):
+            tag_id, _, version = tag[1:-1].partition("-")
+            if tag_id == str(row_id) and version.isdigit():
+                versions.append(int(version))
+    return versions
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(status_code=412, detail="Precondition failed")
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Annotated
+from urllib.parse import urlsplit
+
+from fastapi import Depends
+from fastapi.encoders import jsonable_encoder
+
+from fastapi_project.config import settings
+from fastapi_project.utils.metrics import Counter, Gauge
+from fastapi_project.utils.serialization import dumps
+
+
+logger = logging.getLogger(__name__)
+
+events_published = Counter("events_published_total", "Change events published by this worker", ("type",))
+events_dropped = Counter("events_dropped_total", "Change events that were not delivered", ("reason",))
+events_subscribers = Gauge("events_subscribers", "Open GET /events streams in this worker")
+events_reconnects = Counter("events_reconnects_total", "Broker connection attempts after the connection was lost", ("result",))
+
+# Очередь подписчика переполнена или события могли потеряться: поток закрывается событием overflow,
+# клиент досинхронизируется через GET /sync
+OVERFLOW = object()
+
+
+class Subscription:
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+    async def get(self):
+        return await self.queue.get()
+
+    def put(self, event: bytes):
+        if self.closed:
+            return
+        # Последнее место очереди оставлено для OVERFLOW
+        if self.queue.qsize() >= self.queue.maxsize - 1:
+            self.overflow("overflow")
+            return
+        self.queue.put_nowait(event)
+
+    def overflow(self, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put_nowait(OVERFLOW)
+        events_dropped.inc(reason=reason)
+
+
+class MemoryBroker:
+    """События изменений в пределах одного процесса: для SQLite, тестов и одного воркера.
+
+    У подписчика одна ограниченная очередь и никаких фоновых задач, поэтому простаивающий поток
+    стоит одну корутину, ожидающую очередь. Медленный подписчик не задерживает публикацию:
+    при переполнении очереди его поток закрывается.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[Subscription]] = {}
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int):
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        events_subscribers.set(sum(len(subscriptions) for subscriptions in self._subscribers.values()))
+        try:
+            yield subscription
+        finally:
+            subscriptions = self._subscribers[user_id]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[user_id]
+            events_subscribers.set(sum(len(subscriptions) for subscriptions in self._subscribers.values()))
+
+    # Событие уже в формате потока: тип и JSON одной строкой
+    def deliver(self, user_id: int, event: bytes):
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.put(event)
+
+    def publish(self, user_id: int, type: str, data: list):
+        events_published.inc(type=type)
+        self.deliver(user_id, encode_event(type, data))
+
+    # Закрывает все потоки воркера событием overflow
+    def resync(self, reason: str):
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                subscription.overflow(reason)
+
+
+# Событие - тип и список строк (для удаления - только id). Пакетные операции публикуют одно событие
+def encode_event(type: str, data: list) -> bytes:
+    return dumps({"type": type, "data": jsonable_encoder(data)})
+
+
+class PostgresBroker(MemoryBroker):
+    """События между воркерами через LISTEN/NOTIFY PostgreSQL.
+
+    Каждый воркер держит одно соединение asyncpg: слушает канал и через него же отправляет NOTIFY.
+    Обработчики не ждут отправки: события уходят из очереди фоновой задачей, поэтому запись
+    не получает лишнего обращения к базе. Доставка не гарантирована (перезапуск воркера, разрыв
+    соединения), пропущенное клиент получает через GET /sync. При разрыве соединения воркер
+    закрывает свои потоки событием overflow и переподключается с растущей паузой, после
+    переподключения закрывает потоки, открытые во время разрыва.
+    """
+
+    CHANNEL = "fastapi_project_events"
+    # Предел NOTIFY - 8000 байт, большое событие делится на несколько
+    MAX_PAYLOAD = 7900
+    # Пауза перед переподключением в секундах: от RECONNECT_MIN, удваивается до RECONNECT_MAX
+    RECONNECT_MIN = 0.5
+    RECONNECT_MAX = 30
+
+    def __init__(self, url: str, queue_size: int):
+        super().__init__(queue_size)
+        parts = urlsplit(url)
+        self.url = parts._replace(scheme="postgresql").geturl()
+        self._outgoing = asyncio.Queue(1000)
+        self._connection = None
+        self._lost = asyncio.Event()
+        self._supervisor = None
+        self._sender = None
+
+    # Первое подключение при старте: недоступная база останавливает запуск приложения
+    async def start(self):
+        await self._connect()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def close(self):
+        for task in (self._supervisor, self._sender):
+            if task is not None:
+                task.cancel()
+        await self._disconnect()
+
+    async def _open(self):
+        import asyncpg
+
+        return await asyncpg.connect(self.url)
+
+    async def _connect(self):
+        lost = asyncio.Event()
+        connection = await self._open()
+        try:
+            await connection.add_listener(self.CHANNEL, self._on_notification)
+        except BaseException:
+            await connection.close()
+            raise
+        connection.add_termination_listener(lambda connection: lost.set())
+        self._connection, self._lost = connection, lost
+
+    async def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close(timeout=1)
+            except Exception as e:
+                logger.warning("Closing the events connection failed: %s", e)
+
+    # Отправляет события, пока соединение живо, и переподключается после разрыва
+    async def _supervise(self):
+        while True:
+            self._sender = asyncio.create_task(self._send())
+            await self._lost.wait()
+            self._sender.cancel()
+            logger.error("Events connection lost, reconnecting")
+            await self._disconnect()
+            self.resync("disconnected")
+            delay = self.RECONNECT_MIN
+            while True:
+                await asyncio.sleep(delay)
+                try:
+                    await self._connect()
+                except Exception as e:
+                    events_reconnects.inc(result="error")
+                    logger.warning("Events reconnect failed, next attempt in %.1fs: %s", min(delay * 2, self.RECONNECT_MAX), e)
+                    delay = min(delay * 2, self.RECONNECT_MAX)
+                    continue
+                events_reconnects.inc(result="ok")
+                break
+            # Потоки, открытые во время разрыва, тоже могли пропустить события
+            self.resync("disconnected")
+
+    def _on_notification(self, connection, pid, channel, payload: str):
+        user_id, _, event = payload.partition(":")
+        self.deliver(int(user_id), event.encode())
+
+    async def _send(self):
+        while True:
+            payload = await self._outgoing.get()
+            try:
+                await self._connection.execute("SELECT pg_notify($1, $2)", self.CHANNEL, payload)
+            except Exception as e:
+                events_dropped.inc(reason="notify_error")
+                logger.error("Event notification failed: %s", e)
+                if self._connection.is_closed():
+                    self._lost.set()
+                    return
+
+    def publish(self, user_id: int, type: str, data: list):
+        events_published.inc(type=type)
+        for payload in self.payloads(user_id, type, data):
+            try:
+                self._outgoing.put_nowait(payload)
+            except asyncio.QueueFull:
+                events_dropped.inc(reason="publish_queue")
+
+    # "user_id:событие" не длиннее MAX_PAYLOAD байт. Строка, которая не помещается сама, передается одним id
+    @classmethod
+    def payloads(cls, user_id: int, type: str, data: list) -> list[str]:
+        prefix = f"{user_id}:" + dumps({"type": type, "data": []}).decode()[:-3]
+        limit = cls.MAX_PAYLOAD - len(prefix.encode()) - 3
+        payloads, chunk, size = [], [], 0
+        for row in jsonable_encoder(data):
+            encoded = dumps(row)
+            if len(encoded) > limit:
+                encoded = dumps({"id": row["id"]})
+            if chunk and size + 1 + len(encoded) > limit:
+                payloads.append(prefix + "[" + b",".join(chunk).decode() + "]}")
+                chunk, size = [], 0
+            size += len(encoded) + (1 if chunk else 0)
+            chunk.append(encoded)
+        payloads.append(prefix + "[" + b",".join(chunk).decode() + "]}")
+        return payloads
+
+
+def make_broker(url: str):
+    if url.startswith("memory://"):
+        return MemoryBroker(settings.EVENTS_QUEUE_SIZE)
+    if url.startswith(("postgresql://", "postgresql+asyncpg://")):
+        return PostgresBroker(url, settings.EVENTS_QUEUE_SIZE)
+    raise ValueError(f"Unsupported events broker URL {url}")
+
+
+event_broker = make_broker(settings.EVENTS_URL)
+
+
+def get_event_broker() -> MemoryBroker:
+    return event_broker
+
+EventBrokerDP = Annotated[MemoryBroker, Depends(get_event_broker)]
@@ -0,0 +1,30 @@
+import re
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+# Строки плана с полным проходом по таблице: "SCAN task" в SQLite (в том числе по индексу целиком),
+# "Seq Scan on task" в PostgreSQL
+FULL_SCAN = {
+    "sqlite": re.compile(r"^SCAN (\w+)"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+}
+
+
+async def explain(conn: AsyncConnection, statement: str, parameters) -> list[str]:
+    if conn.dialect.name == "sqlite":
+        result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in result]
+    result = await conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+    return [row[0] for row in result]
+
+
+# Таблицы из tables, которые запрос читает полным проходом
+async def full_scans(conn: AsyncConnection, statement: str, parameters, tables: set[str]) -> set[str]:
+    pattern = FULL_SCAN[conn.dialect.name]
+    scanned = set()
+    for line in await explain(conn, statement, parameters):
+        match = pattern.search(line.strip())
+        if match and match.group(1) in tables:
+            scanned.add(match.group(1))
+    return scanned
@@ -1,47 +1,165 @@
+"""Генератор тестовых данных.
+
+    python -m fastapi_project.utils.fake_db --users 1000 --lists 5 --tasks 10 --seed 42 --workers 4
+
+Строки генерируются блоками пользователей и вставляются массово (COPY на PostgreSQL,
+executemany на SQLite) с заранее вычисленными id, поэтому блоки независимы и их можно
+генерировать параллельно в нескольких процессах. Один и тот же seed дает одни и те же данные,
+включая хэш пароля: соль bcrypt тоже выводится из seed.
+У всех пользователей один пароль (--password), чтобы под ними можно было залогиниться.
+"""
+import argparse
 import asyncio
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
 from faker import Faker
+from passlib.hash import bcrypt
+from passlib.utils.binary import bcrypt64
+from sqlalchemy import func, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi_project.database import User, TODOList, Task, SessionDP, engine
-from sqlalchemy import select
 
-fake = Faker()
+from fastapi_project.database import User, TODOList, Task, async_session
+from fastapi_project.utils.bulk import copy_rows
 
-# Асинхронная функция для заполнения базы данных
-async def populate_database(session: AsyncSession, num_users: int = 1000, num_todolists_per_user: int = 5, num_tasks_per_list: int = 10):
-    # Создаем пользователей
-    users = []
-    for _ in range(num_users):
-        user = User(username=fake.unique.user_name(), password=fake.password())
-        session.add(user)
-        users.append(user)
-    await session.commit()
 
-    # Подгружаем созданных пользователей
-    result = await session.execute(select(User))
-    users = result.scalars().all()
-
-    # Создаем TODO-листы для каждого пользователя
-    for user in users:
-        for _ in range(num_todolists_per_user):
-            todo_list = TODOList(user=user.id, title=fake.sentence(nb_words=3))
-            session.add(todo_list)
-            await session.commit()  # Коммит, чтобы получить ID TODO-листа
-
-            # Подгружаем созданный TODO-лист
-            result = await session.execute(select(TODOList).where(TODOList.user == user.id))
-            todo_list = result.scalars().first()
-
-            # Создаем задачи для TODO-листа
-            for _ in range(num_tasks_per_list):
-                task = Task(todo_list=todo_list.id, note=fake.sentence(nb_words=5))
-                session.add(task)
+# Параметры генерации, передаются в процессы-генераторы
+@dataclass(frozen=True)
+class Plan:
+    seed: int
+    num_users: int
+    num_todolists_per_user: int
+    num_tasks_per_list: int
+    users_per_chunk: int
+    first_user_id: int
+    first_todolist_id: int
+    first_task_id: int
+    password_hash: str
+    words: tuple[str, ...]
+
+    @property
+    def chunks(self) -> int:
+        return -(-self.num_users // self.users_per_chunk)
+
+
+# Строки одного блока пользователей. Зависит только от plan и номера блока
+def generate_chunk(plan: Plan, index: int) -> tuple[list[tuple], list[tuple], list[tuple]]:
+    rng = random.Random(f"{plan.seed}:{index}")
+    words = plan.words
+    users, todolists, tasks = [], [], []
+    first = index * plan.users_per_chunk
+    for user_index in range(first, min(first + plan.users_per_chunk, plan.num_users)):
+        user_id = plan.first_user_id + user_index
+        users.append((user_id, f"{rng.choice(words)}_{user_id}", plan.password_hash))
+        for list_offset in range(plan.num_todolists_per_user):
+            list_index = user_index * plan.num_todolists_per_user + list_offset
+            todolist_id = plan.first_todolist_id + list_index
+            todolists.append((todolist_id, user_id, " ".join(rng.choices(words, k=3)).capitalize()))
+            for task_offset in range(plan.num_tasks_per_list):
+                task_id = plan.first_task_id + list_index * plan.num_tasks_per_list + task_offset
+                tasks.append((task_id, todolist_id, " ".join(rng.choices(words, k=5)).capitalize() + "."))
+    return users, todolists, tasks
+
+
+# Хэш пароля с солью из seed: одинаковый seed дает одинаковый хэш. bcrypt считается один раз на всех пользователей
+def password_hash(password: str, seed: int) -> str:
+    salt = bcrypt64.encode_bytes(random.Random(f"{seed}:password").randbytes(16)).decode()
+    return bcrypt.using(salt=salt).hash(password)
+
+
+async def write_chunk(session: AsyncSession, chunk: tuple[list[tuple], list[tuple], list[tuple]]):
+    users, todolists, tasks = chunk
+    await copy_rows(session, User.__table__, ["id", "username", "password"], users)
+    await copy_rows(session, TODOList.__table__, ["id", "user", "title"], todolists)
+    await copy_rows(session, Task.__table__, ["id", "todo_list", "note"], tasks)
     await session.commit()
 
+
+async def next_id(session: AsyncSession, model) -> int:
+    result = await session.execute(select(func.max(model.id)))
+    return (result.scalar() or 0) + 1
+
+
+# Асинхронная функция для заполнения базы данных
+async def populate_database(
+    session: AsyncSession,
+    num_users: int = 1000,
+    num_todolists_per_user: int = 5,
+    num_tasks_per_list: int = 10,
+    seed: int = 0,
+    batch_size: int = 50000,
+    workers: int = 0,
+    password: str = "password",
+):
+    fake = Faker()
+    fake.seed_instance(seed)
+    rows_per_user = 1 + num_todolists_per_user * (1 + num_tasks_per_list)
+    plan = Plan(
+        seed=seed,
+        num_users=num_users,
+        num_todolists_per_user=num_todolists_per_user,
+        num_tasks_per_list=num_tasks_per_list,
+        users_per_chunk=max(1, batch_size // rows_per_user),
+        first_user_id=await next_id(session, User),
+        first_todolist_id=await next_id(session, TODOList),
+        first_task_id=await next_id(session, Task),
+        password_hash=password_hash(password, seed),
+        words=tuple(fake.words(nb=1000)),
+    )
+
+    started = time.perf_counter()
+    if workers:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(workers) as executor:
+            # Не больше 2 * workers готовых блоков ждут записи в базу
+            pending = deque()
+            for index in range(plan.chunks):
+                pending.append(loop.run_in_executor(executor, generate_chunk, plan, index))
+                if len(pending) >= workers * 2:
+                    await write_chunk(session, await pending.popleft())
+            while pending:
+                await write_chunk(session, await pending.popleft())
+    else:
+        for index in range(plan.chunks):
+            await write_chunk(session, generate_chunk(plan, index))
+
+    # id вставлялись явно, последовательности PostgreSQL нужно сдвинуть вручную
+    if session.bind.dialect.name == "postgresql":
+        for table in ("user", "todolist", "task"):
+            await session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), (SELECT max(id) FROM \"{table}\"))"
+            ))
+        await session.commit()
+    return time.perf_counter() - started
+
+
 # Асинхронный контекстный менеджер
-async def main(engine):
-    async with SessionDP(engine) as session:
-        await populate_database(session=session)
+async def main(args: argparse.Namespace):
+    async with async_session() as session:
+        elapsed = await populate_database(
+            session=session,
+            num_users=args.users,
+            num_todolists_per_user=args.lists,
+            num_tasks_per_list=args.tasks,
+            seed=args.seed,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            password=args.password,
+        )
+    tasks = args.users * args.lists * args.tasks
+    print(f"{args.users} users, {args.users * args.lists} todo lists, {tasks} tasks in {elapsed:.1f}s")
+
 
 if __name__ == "__main__":
-    # Вызов функции main()
-    asyncio.run(main(engine))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--lists", type=int, default=5, help="todo lists per user")
+    parser.add_argument("--tasks", type=int, default=10, help="tasks per todo list")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per insert batch")
+    parser.add_argument("--workers", type=int, default=0, help="generator processes, 0 to generate inline")
+    parser.add_argument("--password", default="password")
+    asyncio.run(main(parser.parse_args()))
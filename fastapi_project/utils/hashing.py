@@ -0,0 +1,35 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from fastapi_project.utils.metrics import Counter, Gauge
+
+
+hashing_pending = Gauge("hashing_pending", "Password hashing jobs running or queued")
+hashing_rejected = Counter("hashing_rejected_total", "Password hashing jobs rejected because the queue was full")
+
+
+# Пул потоков для bcrypt: хэширование блокирует поток на десятки миллисекунд,
+# поэтому выполняется вне event loop. Не больше workers задач выполняется одновременно
+# и не больше max_queue ждут своей очереди, остальные получают 503
+class HashingPool:
+    def __init__(self, workers: int, max_queue: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashing")
+        self._max_pending = workers + max_queue
+        self._pending = 0
+
+    async def run(self, func, *args):
+        if self._pending >= self._max_pending:
+            hashing_rejected.inc()
+            raise HTTPException(status_code=503, detail="Server is busy", headers={"Retry-After": "1"})
+        self._pending += 1
+        hashing_pending.set(self._pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            hashing_pending.set(self._pending)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,143 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from fastapi import Depends, Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from fastapi_project.config import settings
+from fastapi_project.utils.metrics import Histogram
+
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("fastapi_project.slow_queries")
+
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route", ("method", "route", "status"))
+request_queries = Histogram(
+    "http_request_db_queries", "SQL statements executed per request", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent in SQL statements per request", ("method", "route"))
+
+
+# Счетчики текущего запроса. События SQLAlchemy выполняются в контексте запроса:
+# greenlet, в котором AsyncSession вызывает драйвер, наследует контекстные переменные задачи
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # Бюджет SQL-запросов маршрута и название маршрута для сообщения о превышении
+        self.query_budget: int | None = None
+        self.route: str | None = None
+        self.budget_reported = False
+
+
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+# Значения параметров в журнал не попадают: там могут быть пароли и личные данные, остаются только типы
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"{len(parameters)} x {redact_parameters(parameters[0])}"
+        return tuple(type(value).__name__ for value in parameters)
+    return type(parameters).__name__
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Бюджет SQL-запросов маршрута: dependencies=[query_budget(3)]. Считаются все запросы, включая авторизацию.
+# Режим задает QUERY_BUDGET_MODE: в "error" запрос сверх бюджета завершается исключением,
+# в "warn" превышение пишется в журнал один раз за запрос, в "off" бюджет не проверяется
+def query_budget(max_queries: int):
+    def set_budget(request: Request):
+        stats = request_stats.get()
+        if stats is not None:
+            stats.query_budget = max_queries
+            stats.route = f"{request.method} {request.scope['route'].path}"
+    return Depends(set_budget)
+
+
+def _check_budget(stats: RequestStats, statement: str):
+    if stats.query_budget is None or stats.queries <= stats.query_budget or settings.QUERY_BUDGET_MODE == "off":
+        return
+    message = f"{stats.route} exceeded its budget of {stats.query_budget} SQL statements: {statement}"
+    if settings.QUERY_BUDGET_MODE == "error":
+        raise QueryBudgetExceeded(message)
+    if not stats.budget_reported:
+        stats.budget_reported = True
+        logger.warning(message)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed >= settings.SLOW_QUERY_SECONDS:
+        slow_query_logger.warning("Slow query (%.3fs): %s; parameters: %s", elapsed, statement, redact_parameters(parameters))
+    if stats is not None:
+        _check_budget(stats, statement)
+
+
+def _handle_error(exception_context):
+    # Запрос с ошибкой не доходит до after_cursor_execute
+    started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine: AsyncEngine):
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+class InstrumentationMiddleware:
+    """Время ответа, число SQL-запросов и время в базе по маршрутам.
+
+    Метрики отдаются через GET /metrics, значения текущего запроса - заголовком Server-Timing.
+    Заголовок отправляется вместе с началом ответа, поэтому запросы потокового тела в нем не учтены,
+    в метрики они попадают. Маршрут берется шаблоном пути, чтобы число меток не росло с числом id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = (
+                    f'db;desc="{stats.queries} queries";dur={stats.db_seconds * 1000:.1f}, '
+                    f"app;dur={(time.perf_counter() - started) * 1000:.1f}"
+                )
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            route = scope["route"].path if "route" in scope else "unmatched"
+            request_duration.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status)
+            request_queries.observe(stats.queries, method=scope["method"], route=route)
+            request_db_seconds.observe(stats.db_seconds, method=scope["method"], route=route)
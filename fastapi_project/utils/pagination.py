@@ -0,0 +1,119 @@
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlmodel import SQLModel
+
+
+# Курсор непрозрачен для клиента: base64 от JSON с id последней строки страницы
+def encode_cursor(last_id: int) -> str:
+    return _encode({"id": last_id})
+
+
+def decode_cursor(cursor: str) -> int:
+    last_id = _decode(cursor).get("id")
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+# Позиция внутри постраничной синхронизации GET /sync: верхняя граница времени изменений, наибольшее
+# уже отданное время изменения, раздел ответа и (время изменения, id) последней отданной строки раздела
+@dataclass(frozen=True)
+class SyncPage:
+    until: datetime
+    seen: datetime
+    section: int
+    changed_at: datetime | None = None
+    last_id: int | None = None
+
+
+# Курсор GET /sync: время последнего изменения, которое получил клиент.
+# Курсор продолжения (ответ с more) хранит начало синхронизации и позицию в ней
+def encode_sync_cursor(changed_at: datetime, page: SyncPage | None = None) -> str:
+    payload = {"at": changed_at.isoformat()}
+    if page is not None:
+        payload["page"] = [
+            page.until.isoformat(), page.seen.isoformat(), page.section,
+            page.changed_at.isoformat() if page.changed_at is not None else None, page.last_id,
+        ]
+    return _encode(payload)
+
+
+def decode_sync_cursor(cursor: str) -> tuple[datetime, SyncPage | None]:
+    payload = _decode(cursor)
+    try:
+        changed_at = datetime.fromisoformat(payload["at"])
+        if "page" not in payload:
+            return changed_at, None
+        until, seen, section, last_changed_at, last_id = payload["page"]
+        if not isinstance(section, int) or not (last_id is None or isinstance(last_id, int)) or (last_id is None) != (last_changed_at is None):
+            raise ValueError("Invalid page")
+        page = SyncPage(
+            datetime.fromisoformat(until), datetime.fromisoformat(seen), section,
+            datetime.fromisoformat(last_changed_at) if last_changed_at is not None else None, last_id,
+        )
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return changed_at, page
+
+
+# Курсор поиска: результаты упорядочены по рангу, курсор хранит ранг и id последней задачи страницы
+def encode_rank_cursor(rank: list, last_id: int) -> str:
+    return _encode({"rank": rank, "id": last_id})
+
+
+def decode_rank_cursor(cursor: str) -> tuple[list, int]:
+    payload = _decode(cursor)
+    rank, last_id = payload.get("rank"), payload.get("id")
+    if (
+        not isinstance(last_id, int) or not isinstance(rank, list) or not rank
+        or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in rank)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return rank, last_id
+
+
+def _encode(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return payload
+
+
+# Размер страницы GET /todo и GET /task, если клиент передал after без limit
+PAGE_SIZE = 100
+
+
+# Без limit и after списки отдаются целиком, как до появления пагинации: клиенты, которые не знают
+# о X-Next-Cursor, не должны молча терять строки. С after без limit страница - PAGE_SIZE строк
+def page_limit(limit: int | None, after: str | None) -> int | None:
+    if limit is None and after is not None:
+        return PAGE_SIZE
+    return limit
+
+
+# Страница запрашивается с limit + 1 строкой: лишняя строка означает, что есть следующая страница.
+# Курсор следующей страницы возвращается заголовком X-Next-Cursor. limit None - весь список
+def paginate(rows: list[SQLModel], limit: int | None) -> tuple[list[SQLModel], dict[str, str]]:
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        return rows, {"X-Next-Cursor": encode_cursor(rows[-1].id)}
+    return rows, {}
+
+
+# Построчная выдача NDJSON, строки читаются из базы курсором по мере отправки
+async def stream_ndjson(session_factory, query):
+    async with session_factory() as session:
+        result = await session.stream(query)
+        async for row in result.scalars():
+            yield row.model_dump_json() + "\n"
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request
+
+from fastapi_project.config import settings
+from fastapi_project.utils.cache import TTLCache
+from fastapi_project.utils.metrics import Counter, Gauge
+from fastapi_project.utils.response_cache import CacheError, RedisBackend
+
+
+logger = logging.getLogger(__name__)
+
+rate_limit_requests = Counter("rate_limit_requests_total", "Rate limit checks", ("scope", "result"))
+admission_waiting = Gauge("db_admission_waiting", "Requests waiting for a database session slot", ("database",))
+admission_rejected = Counter("db_admission_rejected_total", "Requests shed before taking a database session", ("database", "reason"))
+
+
+# Корзины токенов в памяти процесса: в корзине до burst токенов, за секунду добавляется rate.
+# Корзина хранится, пока не наполнится снова, поэтому отсутствующая корзина - полная
+class MemoryBuckets:
+    def __init__(self, maxsize: int):
+        self._buckets = TTLCache(maxsize, ttl=3600)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Забирает токен и возвращает 0 или, если корзина пуста, сколько секунд ждать следующего"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets.set(key, (tokens, now), ttl=(burst - tokens) / rate)
+        return wait
+
+    async def close(self):
+        self._buckets.clear()
+
+
+# Те же корзины в Redis, общие для всех воркеров. Корзина обновляется атомарно скриптом Lua,
+# время берется у Redis, чтобы часы воркеров не влияли на результат
+class RedisBuckets:
+    SCRIPT = """
+        local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, url: str):
+        self.redis = RedisBackend(url)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        return float(await self.redis.command("EVAL", self.SCRIPT, 1, key, rate, burst))
+
+    async def close(self):
+        await self.redis.close()
+
+
+def make_buckets(url: str):
+    if url.startswith("memory://"):
+        return MemoryBuckets(settings.RATE_LIMIT_BUCKETS)
+    if url.startswith("redis://"):
+        return RedisBuckets(url)
+    raise ValueError(f"Unsupported rate limit URL {url}")
+
+
+class RateLimiter:
+    """Ограничение частоты запросов корзинами токенов.
+
+    Пустая корзина отвечает 429 с Retry-After. rate <= 0 отключает ограничение.
+    Недоступное хранилище корзин запросы не останавливает.
+    """
+
+    def __init__(self, buckets, prefix: str = "rate"):
+        self.buckets = buckets
+        self.prefix = prefix
+
+    async def hit(self, scope: str, key: str, rate: float, burst: int):
+        if rate <= 0:
+            return
+        try:
+            wait = await self.buckets.take(f"{self.prefix}:{scope}:{key}", rate, burst)
+        except (OSError, asyncio.TimeoutError, CacheError) as e:
+            logger.warning("Rate limit storage is unavailable: %s", e)
+            rate_limit_requests.inc(scope=scope, result="error")
+            return
+        if wait > 0:
+            rate_limit_requests.inc(scope=scope, result="limited")
+            raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))})
+        rate_limit_requests.inc(scope=scope, result="allowed")
+
+
+rate_limiter = RateLimiter(make_buckets(settings.RATE_LIMIT_URL))
+
+
+# Ограничение по адресу клиента для маршрутов без авторизации (/login, /register).
+# За обратным прокси адрес клиента подставляет uvicorn --proxy-headers
+async def limit_ip(request: Request):
+    host = request.client.host if request.client else "unknown"
+    await rate_limiter.hit("ip", f"{request.scope['route'].path}:{host}", settings.RATE_LIMIT_IP_RATE, settings.RATE_LIMIT_IP_BURST)
+
+
+# Не больше limit сессий базы одновременно. Остальные запросы ждут не дольше timeout и не больше max_waiting
+# сразу, иначе получают 503: лучше быстро отказать части запросов, чем дождаться таймаута пула у всех.
+# У каждого движка свой ограничитель (database.admission_limiters), name - база в метриках.
+# Ограничители создаются при импорте, а семафор привязывается к event loop, поэтому он создается
+# при первом запросе в каждом новом loop (тесты и приложения, запущенные в другом loop)
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, max_waiting: int, timeout: float, name: str = ""):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.name = name
+        self.waiting = 0
+        self._loop = None
+        self._slots = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._slots = loop, asyncio.Semaphore(self.limit)
+            self.waiting = 0
+        return self._slots
+
+    @asynccontextmanager
+    async def slot(self):
+        slots = self._semaphore()
+        if slots.locked():
+            if self.waiting >= self.max_waiting:
+                admission_rejected.inc(database=self.name, reason="queue_full")
+                raise self._overloaded()
+            self.waiting += 1
+            admission_waiting.set(self.waiting, database=self.name)
+            try:
+                async with asyncio.timeout(self.timeout):
+                    await slots.acquire()
+            except TimeoutError:
+                admission_rejected.inc(database=self.name, reason="timeout")
+                raise self._overloaded()
+            finally:
+                self.waiting -= 1
+                admission_waiting.set(self.waiting, database=self.name)
+        else:
+            await slots.acquire()
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def _overloaded(self) -> HTTPException:
+        return HTTPException(status_code=503, detail="Server is busy", headers={"Retry-After": str(max(1, math.ceil(self.timeout)))})
+
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+
+import jwt
+
+from fastapi_project.config import settings
+from fastapi_project.utils.metrics import Counter
+from fastapi_project.utils.response_cache import CacheError, RedisBackend
+
+
+logger = logging.getLogger(__name__)
+
+routing_decisions = Counter("db_session_routing_total", "Request sessions by database and routing reason", ("target", "reason"))
+
+
+# Отметки записи в памяти процесса (только для одного воркера): ключ -> конец окна. В отличие от кэша ответов
+# отметки не вытесняются. Просроченные удаляются при записи, когда словарь вырастает вдвое с прошлой очистки
+class MemoryMarks:
+    def __init__(self):
+        self._until = {}
+        self._prune_at = 1024
+
+    async def set(self, key: str, ttl: float):
+        now = time.monotonic()
+        self._until[key] = now + ttl
+        if len(self._until) >= self._prune_at:
+            self._until = {key: until for key, until in self._until.items() if until > now}
+            self._prune_at = max(1024, 2 * len(self._until))
+
+    async def exists(self, key: str) -> bool:
+        until = self._until.get(key)
+        return until is not None and until > time.monotonic()
+
+    async def close(self):
+        self._until.clear()
+
+
+# Отметки в Redis, общие для всех воркеров. Время жизни в миллисекундах, окно короче секунды не округляется
+class RedisMarks:
+    def __init__(self, url: str):
+        self.redis = RedisBackend(url)
+
+    async def set(self, key: str, ttl: float):
+        await self.redis.command("SET", key, b"1", "PX", max(1, int(ttl * 1000)))
+
+    async def exists(self, key: str) -> bool:
+        return await self.redis.command("GET", key) is not None
+
+    async def close(self):
+        await self.redis.close()
+
+
+def make_marks(url: str):
+    if url.startswith("memory://"):
+        return MemoryMarks()
+    if url.startswith("redis://"):
+        return RedisMarks(url)
+    raise ValueError(f"Unsupported replica sticky URL {url}")
+
+
+class ReadRouter:
+    """Выбор базы для сессии запроса при настроенной реплике (REPLICA_DB_URL).
+
+    GET и HEAD читают из реплики, остальные запросы идут в основную базу. После записи пользователь
+    sticky_seconds секунд читает из основной базы, чтобы видеть свои изменения, пока реплика догоняет.
+    Окно привязано к пользователю, а не к клиенту: иначе кэш ответов, общий для всех клиентов
+    пользователя, мог бы заполниться из отстающей реплики сразу после записи.
+    Отметки хранятся отдельно от кэша ответов (REPLICA_STICKY_URL), чтобы их не вытесняли ответы,
+    с Redis окно общее для всех воркеров. Недоступное хранилище отправляет чтение в основную базу.
+    """
+
+    def __init__(self, marks, sticky_seconds: float, prefix: str = "sticky"):
+        self.marks = marks
+        self.sticky_seconds = sticky_seconds
+        self.prefix = prefix
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    async def mark_write(self, user_id: int):
+        try:
+            await self.marks.set(self._key(user_id), self.sticky_seconds)
+        except (OSError, asyncio.TimeoutError, CacheError) as e:
+            logger.error("Read-your-writes mark failed for user %s: %s", user_id, e)
+
+    async def is_sticky(self, user_id: int) -> bool:
+        try:
+            return await self.marks.exists(self._key(user_id))
+        except (OSError, asyncio.TimeoutError, CacheError) as e:
+            logger.warning("Read-your-writes lookup failed for user %s: %s", user_id, e)
+            return True
+
+    async def route(self, method: str, user_id: int | None) -> tuple[str, str]:
+        """Возвращает (target, reason): target - "primary" или "replica"."""
+        if method not in ("GET", "HEAD"):
+            target, reason = "primary", "write"
+        # Без id пользователя (старый токен без uid) неизвестно, писал ли он недавно
+        elif user_id is None:
+            target, reason = "primary", "unknown_user"
+        elif await self.is_sticky(user_id):
+            target, reason = "primary", "sticky"
+        else:
+            target, reason = "replica", "read"
+        routing_decisions.inc(target=target, reason=reason)
+        return target, reason
+
+
+# id пользователя из заголовка Authorization без проверки подписи: только для выбора базы,
+# сам токен проверяет get_current_user. Поддельный uid в худшем случае отправит чтение в основную базу
+def token_user_id(authorization: str | None) -> int | None:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        user_id = jwt.decode(token, options={"verify_signature": False}).get("uid")
+    except jwt.PyJWTError:
+        return None
+    return user_id if isinstance(user_id, int) else None
+
+
+read_router = ReadRouter(make_marks(settings.REPLICA_STICKY_URL), settings.REPLICA_STICKY_SECONDS)
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Annotated, Awaitable, Callable
+from urllib.parse import urlsplit
+
+from fastapi import Depends, Response
+from fastapi.encoders import jsonable_encoder
+
+from fastapi_project.config import settings
+from fastapi_project.utils.cache import TTLCache
+from fastapi_project.utils.metrics import Counter
+from fastapi_project.utils.serialization import dumps
+
+
+logger = logging.getLogger(__name__)
+
+cache_requests = Counter("response_cache_requests_total", "Response cache lookups", ("result",))
+cache_evictions = Counter("response_cache_evictions_total", "Response cache entries evicted to stay within the size limit")
+
+
+class CacheError(Exception):
+    pass
+
+
+# Хранилище в памяти процесса. Версии пользователей хранятся отдельно и не вытесняются по размеру:
+# иначе после вытеснения версия начнется заново и станут видны старые записи.
+# Версия, к которой не обращались дольше 2 * ttl, удаляется. Запись сохраняется после чтения версии
+# и живет не дольше ttl, поэтому если загрузка ответа короче ttl, все записи со старыми номерами к этому времени истекли
+class MemoryBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self._data = TTLCache(maxsize, ttl, on_evict=cache_evictions.inc)
+        self._counters: dict[str, tuple[int, float]] = {}
+        self._counter_idle = 2 * ttl
+        self._prune_at = 1024
+
+    async def get(self, key: str) -> bytes | None:
+        return self._data.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._data.set(key, value, ttl)
+
+    async def get_counter(self, key: str) -> int:
+        counter = self._counters.get(key)
+        if counter is None:
+            return 0
+        self._counters[key] = (counter[0], time.monotonic())
+        return counter[0]
+
+    async def incr(self, key: str) -> int:
+        now = time.monotonic()
+        value = self._counters.get(key, (0, now))[0] + 1
+        self._counters[key] = (value, now)
+        # Просроченные версии удаляются, когда их число вырастает вдвое с прошлой очистки
+        if len(self._counters) >= self._prune_at:
+            self._counters = {key: counter for key, counter in self._counters.items() if now - counter[1] <= self._counter_idle}
+            self._prune_at = max(1024, 2 * len(self._counters))
+        return value
+
+    async def close(self):
+        self._data.clear()
+
+
+# Минимальный клиент протокола Redis (RESP) на asyncio streams: GET, SET EX и INCR.
+# Соединения переиспользуются, одновременно открыто не больше pool_size.
+# Вытеснение записей Redis считает сам (evicted_keys в INFO stats)
+class RedisBackend:
+    def __init__(self, url: str, pool_size: int = 10, timeout: float = 1.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = (reader, writer)
+        if self.password:
+            await self._execute(connection, "AUTH", self.password)
+        if self.db:
+            await self._execute(connection, "SELECT", self.db)
+        return connection
+
+    async def _execute(self, connection, *args):
+        reader, writer = connection
+        command = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        writer.write(b"".join(command))
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _read_reply(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise CacheError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            if int(payload) < 0:
+                return None
+            data = await reader.readexactly(int(payload) + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [await self._read_reply(reader) for _ in range(int(payload))]
+        raise CacheError(f"Unexpected reply {line!r}")
+
+    async def command(self, *args):
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            try:
+                if connection is None:
+                    connection = await asyncio.wait_for(self._connect(), self.timeout)
+                reply = await asyncio.wait_for(self._execute(connection, *args), self.timeout)
+            except BaseException:
+                # Соединение в неизвестном состоянии, ответ мог остаться непрочитанным
+                if connection is not None:
+                    connection[1].close()
+                raise
+            self._idle.append(connection)
+            return reply
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.command("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.command("SET", key, value, "EX", max(1, int(ttl)))
+
+    async def get_counter(self, key: str) -> int:
+        return int(await self.command("GET", key) or 0)
+
+    async def incr(self, key: str) -> int:
+        return await self.command("INCR", key)
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+def make_backend(url: str):
+    if url.startswith("memory://"):
+        return MemoryBackend(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
+    if url.startswith("redis://"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported response cache URL {url}")
+
+
+class ResponseCache:
+    """Кэш готовых JSON-ответов по пользователю и ресурсу.
+
+    Ключ записи содержит версию пользователя. Запись данных пользователя увеличивает версию,
+    и все его прежние записи перестают читаться и доживают до конца TTL. Промахи по одному ключу
+    в одном процессе объединяются: ответ из базы загружает первый запрос, остальные ждут его результат.
+    Недоступное хранилище не ломает запросы, ответ просто загружается из базы.
+    """
+
+    def __init__(self, backend, ttl: float, prefix: str = "resp"):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _version_key(self, user_id: int) -> str:
+        return f"{self.prefix}:v:{user_id}"
+
+    async def response(self, user_id: int, resource: str, load: Callable[[], Awaitable[tuple]]) -> Response:
+        """load возвращает (данные ответа, заголовки)"""
+        try:
+            version = await self.backend.get_counter(self._version_key(user_id))
+            key = f"{self.prefix}:{user_id}:{version}:{resource}"
+            value = await self.backend.get(key)
+        except (OSError, asyncio.TimeoutError, CacheError) as e:
+            logger.warning("Response cache is unavailable: %s", e)
+            cache_requests.inc(result="error")
+            return self._decode(await self._load(load))
+        if value is not None:
+            cache_requests.inc(result="hit")
+            return self._decode(value)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            cache_requests.inc(result="coalesced")
+            return self._decode(await asyncio.shield(future))
+
+        cache_requests.inc(result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(load)
+            future.set_result(value)
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получат ожидающие запросы, если они есть
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+        try:
+            await self.backend.set(key, value, self.ttl)
+        except (OSError, asyncio.TimeoutError, CacheError) as e:
+            logger.warning("Response cache is unavailable: %s", e)
+        return self._decode(value)
+
+    async def invalidate(self, user_id: int):
+        try:
+            await self.backend.incr(self._version_key(user_id))
+        except (OSError, asyncio.TimeoutError, CacheError) as e:
+            # Старые записи останутся видны до конца TTL
+            logger.error("Response cache invalidation failed for user %s: %s", user_id, e)
+
+    # Запись хранится одной строкой: JSON заголовков, перевод строки, тело ответа.
+    # load может вернуть уже готовое тело в bytes (RowEncoder)
+    @staticmethod
+    async def _load(load) -> bytes:
+        content, headers = await load()
+        body = content if isinstance(content, bytes) else dumps(jsonable_encoder(content))
+        return json.dumps(headers).encode() + b"\n" + body
+
+    @staticmethod
+    def _decode(value: bytes) -> Response:
+        headers, body = value.split(b"\n", 1)
+        return Response(content=body, media_type="application/json", headers=json.loads(headers))
+
+
+response_cache = ResponseCache(make_backend(settings.RESPONSE_CACHE_URL), settings.RESPONSE_CACHE_TTL)
+
+
+def get_response_cache() -> ResponseCache:
+    return response_cache
+
+ResponseCacheDP = Annotated[ResponseCache, Depends(get_response_cache)]
@@ -0,0 +1,45 @@
+import re
+
+from fastapi import HTTPException
+from sqlalchemy import Select, column, func, literal, literal_column, table, tuple_
+from sqlmodel import select
+
+from fastapi_project.database import Task, TODOList
+
+
+task_fts = table("task_fts", column("rowid"))
+
+
+# Слова запроса. Пользовательский ввод не передается в синтаксис FTS5 и tsquery как есть:
+# каждое слово ищется отдельно, нужны все слова
+def search_terms(q: str) -> list[str]:
+    return re.findall(r"\w+", q.lower())
+
+
+# Задачи пользователя со всеми словами, лучшие совпадения первыми. Выбираются columns и в конце колонки ранга.
+# Совпадения ищутся только среди задач пользователя, поэтому время не растет с числом чужих задач с теми же словами:
+# в PostgreSQL индекс GIN начинается с todo_list (btree_gin), в SQLite документ FTS5 содержит todo_list,
+# и запрос совпадает только с todo пользователя. bm25 в SQLite не используется: частоту слова среди документов
+# он считает по всему индексу. Ранг - число совпадений, затем длина заметки.
+# Ранг не зависит от чужих задач, поэтому следующая страница ищется по рангу и id последней задачи (after)
+def search_tasks_query(dialect: str, user_id: int, terms: list[str], columns, limit: int, after: tuple[list, int] | None = None) -> Select:
+    query = select(*columns).join(TODOList, Task.todo_list==TODOList.id).where(TODOList.user==user_id)
+    if dialect == "postgresql":
+        note_search = literal_column("task.note_search")
+        tsquery = func.plainto_tsquery("simple", " ".join(terms))
+        query = query.where(note_search.op("@@")(tsquery))
+        rank = [-func.ts_rank_cd(note_search, tsquery)]
+    else:
+        lists = select(func.group_concat(TODOList.id, " OR ")).where(TODOList.user==user_id).scalar_subquery()
+        phrases = " ".join(f'"{term}"' for term in terms)
+        match = literal("{todo_list}: (").concat(func.coalesce(lists, "0")).concat(f") AND {{note}}: ({phrases})")
+        # highlight добавляет по символу на каждое совпадение в заметке
+        matches = func.length(func.highlight(literal_column("task_fts"), 0, func.char(1), "")) - func.length(Task.note)
+        query = query.join(task_fts, task_fts.c.rowid==Task.id).where(literal_column("task_fts").op("MATCH")(match))
+        rank = [-matches, func.length(Task.note)]
+    if after is not None:
+        values, last_id = after
+        if len(values) != len(rank):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(*rank, Task.id) > tuple_(*values, last_id))
+    return query.add_columns(*rank).order_by(*rank, Task.id).limit(limit)
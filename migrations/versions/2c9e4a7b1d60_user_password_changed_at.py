@@ -0,0 +1,57 @@
+"""User password_changed_at
+
+Revision ID: 2c9e4a7b1d60
+Revises: f6a0c3e9b215
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c9e4a7b1d60'
+down_revision: Union[str, None] = 'f6a0c3e9b215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Те же выражения, что у utcnow() в database.py
+UTCNOW = {
+    'sqlite': "(STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW'))",
+    'postgresql': "TIMEZONE('utc', CURRENT_TIMESTAMP)",
+}
+
+# Копия триггера todolist_tombstone из database.py для SQLite. Он читает таблицу user, и SQLite не переименовывает
+# пересозданную таблицу, пока такой триггер ссылается на удаленную, поэтому на время пересоздания триггер удаляется
+SQLITE_TRIGGER = """CREATE TRIGGER todolist_tombstone AFTER DELETE ON todolist BEGIN
+            INSERT INTO tombstone (user, kind, entity_id) SELECT id, 'todo', OLD.id FROM user WHERE id = OLD.user;
+        END"""
+
+
+# SQLite не добавляет колонку с вычисляемым значением по умолчанию, таблица пересоздается
+def alter_user_table(alter) -> None:
+    if op.get_context().dialect.name != 'sqlite':
+        with op.batch_alter_table('user') as batch_op:
+            alter(batch_op)
+        return
+    op.execute('DROP TRIGGER todolist_tombstone')
+    with op.batch_alter_table('user', recreate='always') as batch_op:
+        alter(batch_op)
+    op.execute(SQLITE_TRIGGER)
+
+
+def add_column(batch_op) -> None:
+    dialect = op.get_context().dialect.name
+    batch_op.add_column(sa.Column('password_changed_at', sa.DateTime(), server_default=sa.text(UTCNOW[dialect]), nullable=False))
+
+
+def upgrade() -> None:
+    # Существующие пользователи получают время миграции, их прежние токены (без gen) перестают действовать
+    alter_user_table(add_column)
+
+
+def downgrade() -> None:
+    alter_user_table(lambda batch_op: batch_op.drop_column('password_changed_at'))
@@ -0,0 +1,31 @@
+"""Add foreign key indexes
+
+Revision ID: 5b7e2c41a9d3
+Revises: 38de5287962d
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2c41a9d3'
+down_revision: Union[str, None] = '38de5287962d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# На PostgreSQL индексы строятся CONCURRENTLY, чтобы не блокировать запись в таблицы.
+# CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции, отсюда autocommit_block
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_todolist_user'), 'todolist', ['user'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_task_todo_list'), 'task', ['todo_list'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_task_todo_list'), table_name='task', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_todolist_user'), table_name='todolist', postgresql_concurrently=True)
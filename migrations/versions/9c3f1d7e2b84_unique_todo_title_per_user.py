@@ -0,0 +1,31 @@
+"""Unique todo title per user
+
+Revision ID: 9c3f1d7e2b84
+Revises: 5b7e2c41a9d3
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3f1d7e2b84'
+down_revision: Union[str, None] = '5b7e2c41a9d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Составной индекс (user, title) обслуживает и поиск по внешнему ключу user, поэтому ix_todolist_user удаляется.
+# Если у пользователя уже есть todo с одинаковыми названиями, создание индекса упадет - их нужно переименовать заранее
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_todolist_user_title', 'todolist', ['user', 'title'], unique=True, postgresql_concurrently=True)
+        op.drop_index(op.f('ix_todolist_user'), table_name='todolist', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_todolist_user'), 'todolist', ['user'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_todolist_user_title', table_name='todolist', postgresql_concurrently=True)
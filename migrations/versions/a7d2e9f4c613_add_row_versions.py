@@ -0,0 +1,43 @@
+"""Add row versions
+
+Revision ID: a7d2e9f4c613
+Revises: e41a6b0c8f25
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d2e9f4c613'
+down_revision: Union[str, None] = 'e41a6b0c8f25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Те же выражения, что у utcnow() в database.py
+UTCNOW = {
+    'sqlite': "(STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW'))",
+    'postgresql': "TIMEZONE('utc', CURRENT_TIMESTAMP)",
+}
+
+
+def upgrade() -> None:
+    dialect = op.get_context().dialect.name
+    # SQLite не добавляет колонку с вычисляемым значением по умолчанию, таблица пересоздается.
+    # PostgreSQL вычисляет такое значение один раз и не переписывает таблицу
+    recreate = 'always' if dialect == 'sqlite' else 'auto'
+    for table in ('todolist', 'task'):
+        with op.batch_alter_table(table, recreate=recreate) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text(UTCNOW[dialect]), nullable=False))
+
+
+def downgrade() -> None:
+    for table in ('task', 'todolist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -0,0 +1,88 @@
+"""Sync tombstones
+
+Revision ID: c58b3f0a1e72
+Revises: a7d2e9f4c613
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c58b3f0a1e72'
+down_revision: Union[str, None] = 'a7d2e9f4c613'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+UTCNOW = {
+    'sqlite': "(STRFTIME('%Y-%m-%d %H:%M:%f', 'NOW'))",
+    'postgresql': "TIMEZONE('utc', CURRENT_TIMESTAMP)",
+}
+
+# Копия TOMBSTONE_TRIGGERS из database.py на момент миграции
+TRIGGERS = {
+    'sqlite': [
+        """CREATE TRIGGER todolist_tombstone AFTER DELETE ON todolist BEGIN
+            INSERT INTO tombstone (user, kind, entity_id) SELECT id, 'todo', OLD.id FROM user WHERE id = OLD.user;
+        END""",
+        """CREATE TRIGGER task_tombstone AFTER DELETE ON task BEGIN
+            INSERT INTO tombstone (user, kind, entity_id) SELECT user, 'task', OLD.id FROM todolist WHERE id = OLD.todo_list;
+        END""",
+    ],
+    'postgresql': [
+        """CREATE FUNCTION todolist_tombstone() RETURNS trigger AS $$ BEGIN
+            INSERT INTO tombstone ("user", kind, entity_id) SELECT id, 'todo', OLD.id FROM "user" WHERE id = OLD."user";
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        "CREATE TRIGGER todolist_tombstone AFTER DELETE ON todolist FOR EACH ROW EXECUTE FUNCTION todolist_tombstone()",
+        """CREATE FUNCTION task_tombstone() RETURNS trigger AS $$ BEGIN
+            INSERT INTO tombstone ("user", kind, entity_id) SELECT "user", 'task', OLD.id FROM todolist WHERE id = OLD.todo_list;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        "CREATE TRIGGER task_tombstone AFTER DELETE ON task FOR EACH ROW EXECUTE FUNCTION task_tombstone()",
+    ],
+}
+
+
+def upgrade() -> None:
+    dialect = op.get_context().dialect.name
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user', sa.Integer(), nullable=False),
+    sa.Column('kind', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), server_default=sa.text(UTCNOW[dialect]), nullable=False),
+    sa.ForeignKeyConstraint(['user'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstone_user_deleted_at', 'tombstone', ['user', 'deleted_at'], unique=False)
+    for statement in TRIGGERS[dialect]:
+        op.execute(statement)
+
+    # Индекс (todo_list, updated_at) обслуживает и внешний ключ, ix_task_todo_list больше не нужен
+    with op.get_context().autocommit_block():
+        op.create_index('ix_todolist_user_updated_at', 'todolist', ['user', 'updated_at'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_task_todo_list_updated_at', 'task', ['todo_list', 'updated_at'], unique=False, postgresql_concurrently=True)
+        op.drop_index(op.f('ix_task_todo_list'), table_name='task', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_task_todo_list'), 'task', ['todo_list'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_task_todo_list_updated_at', table_name='task', postgresql_concurrently=True)
+        op.drop_index('ix_todolist_user_updated_at', table_name='todolist', postgresql_concurrently=True)
+
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('DROP TRIGGER IF EXISTS task_tombstone ON task')
+        op.execute('DROP TRIGGER IF EXISTS todolist_tombstone ON todolist')
+        op.execute('DROP FUNCTION IF EXISTS todolist_tombstone, task_tombstone')
+    else:
+        op.execute('DROP TRIGGER IF EXISTS task_tombstone')
+        op.execute('DROP TRIGGER IF EXISTS todolist_tombstone')
+    op.drop_index('ix_tombstone_user_deleted_at', table_name='tombstone')
+    op.drop_table('tombstone')
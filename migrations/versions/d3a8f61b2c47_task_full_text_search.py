@@ -0,0 +1,63 @@
+"""Task full-text search
+
+Revision ID: d3a8f61b2c47
+Revises: c58b3f0a1e72
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a8f61b2c47'
+down_revision: Union[str, None] = 'c58b3f0a1e72'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Копия TASK_SEARCH_DDL из database.py на момент миграции
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER task_fts_insert AFTER INSERT ON task BEGIN
+        INSERT INTO task_fts (rowid, note) VALUES (NEW.id, NEW.note);
+    END""",
+    """CREATE TRIGGER task_fts_delete AFTER DELETE ON task BEGIN
+        INSERT INTO task_fts (task_fts, rowid, note) VALUES ('delete', OLD.id, OLD.note);
+    END""",
+    """CREATE TRIGGER task_fts_update AFTER UPDATE OF note ON task BEGIN
+        INSERT INTO task_fts (task_fts, rowid, note) VALUES ('delete', OLD.id, OLD.note);
+        INSERT INTO task_fts (rowid, note) VALUES (NEW.id, NEW.note);
+    END""",
+]
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        # Вычисляемая колонка заполняется для существующих строк при добавлении, таблица переписывается под блокировкой
+        op.add_column('task', sa.Column(
+            'note_search', postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('simple', coalesce(note, ''))", persisted=True),
+        ))
+        with op.get_context().autocommit_block():
+            op.create_index('ix_task_note_search', 'task', ['note_search'], unique=False, postgresql_using='gin', postgresql_concurrently=True)
+    else:
+        op.execute("CREATE VIRTUAL TABLE task_fts USING fts5(note, content='task', content_rowid='id')")
+        # Индекс существующих задач строится из таблицы task
+        op.execute("INSERT INTO task_fts (task_fts) VALUES ('rebuild')")
+        for statement in SQLITE_TRIGGERS:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index('ix_task_note_search', table_name='task', postgresql_concurrently=True)
+        op.drop_column('task', 'note_search')
+    else:
+        op.execute('DROP TRIGGER IF EXISTS task_fts_update')
+        op.execute('DROP TRIGGER IF EXISTS task_fts_delete')
+        op.execute('DROP TRIGGER IF EXISTS task_fts_insert')
+        op.execute('DROP TABLE IF EXISTS task_fts')
@@ -0,0 +1,57 @@
+"""Cascade foreign keys
+
+Revision ID: e41a6b0c8f25
+Revises: 9c3f1d7e2b84
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41a6b0c8f25'
+down_revision: Union[str, None] = '9c3f1d7e2b84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (таблица, колонка, ссылка). Имена ограничений - стандартные имена PostgreSQL, в SQLite ограничения
+# безымянные и получают эти имена через naming_convention при пересоздании таблицы
+FOREIGN_KEYS = [
+    ('todolist', 'user', 'user'),
+    ('task', 'todo_list', 'todolist'),
+]
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def replace_foreign_keys(ondelete: Union[str, None]) -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # NOT VALID не проверяет существующие строки под блокировкой записи. VALIDATE проверяет их
+        # после фиксации замены, в отдельной транзакции и без блокировки записи
+        for table, column, referent in FOREIGN_KEYS:
+            name = f'{table}_{column}_fkey'
+            action = f' ON DELETE {ondelete}' if ondelete else ''
+            op.execute(f'ALTER TABLE "{table}" DROP CONSTRAINT "{name}"')
+            op.execute(
+                f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY ("{column}") '
+                f'REFERENCES "{referent}" (id){action} NOT VALID'
+            )
+        with op.get_context().autocommit_block():
+            for table, column, _ in FOREIGN_KEYS:
+                op.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{table}_{column}_fkey"')
+        return
+    # SQLite не умеет менять ограничения, batch пересоздает таблицу
+    for table, column, referent in FOREIGN_KEYS:
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(f'{table}_{column}_fkey', type_='foreignkey')
+            batch_op.create_foreign_key(f'{table}_{column}_fkey', referent, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade() -> None:
+    replace_foreign_keys(None)
@@ -0,0 +1,81 @@
+"""Scope task full-text search per user
+
+Revision ID: f6a0c3e9b215
+Revises: d3a8f61b2c47
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6a0c3e9b215'
+down_revision: Union[str, None] = 'd3a8f61b2c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Копия TASK_SEARCH_DDL из database.py на момент миграции: в индексе FTS5 появляется todo_list
+SQLITE_TRIGGERS = [
+    """CREATE TRIGGER task_fts_insert AFTER INSERT ON task BEGIN
+        INSERT INTO task_fts (rowid, note, todo_list) VALUES (NEW.id, NEW.note, NEW.todo_list);
+    END""",
+    """CREATE TRIGGER task_fts_delete AFTER DELETE ON task BEGIN
+        INSERT INTO task_fts (task_fts, rowid, note, todo_list) VALUES ('delete', OLD.id, OLD.note, OLD.todo_list);
+    END""",
+    """CREATE TRIGGER task_fts_update AFTER UPDATE OF note, todo_list ON task BEGIN
+        INSERT INTO task_fts (task_fts, rowid, note, todo_list) VALUES ('delete', OLD.id, OLD.note, OLD.todo_list);
+        INSERT INTO task_fts (rowid, note, todo_list) VALUES (NEW.id, NEW.note, NEW.todo_list);
+    END""",
+]
+
+# Триггеры из d3a8f61b2c47
+SQLITE_TRIGGERS_OLD = [
+    """CREATE TRIGGER task_fts_insert AFTER INSERT ON task BEGIN
+        INSERT INTO task_fts (rowid, note) VALUES (NEW.id, NEW.note);
+    END""",
+    """CREATE TRIGGER task_fts_delete AFTER DELETE ON task BEGIN
+        INSERT INTO task_fts (task_fts, rowid, note) VALUES ('delete', OLD.id, OLD.note);
+    END""",
+    """CREATE TRIGGER task_fts_update AFTER UPDATE OF note ON task BEGIN
+        INSERT INTO task_fts (task_fts, rowid, note) VALUES ('delete', OLD.id, OLD.note);
+        INSERT INTO task_fts (rowid, note) VALUES (NEW.id, NEW.note);
+    END""",
+]
+
+
+def recreate_sqlite_fts(columns: str, triggers: list[str]):
+    op.execute('DROP TRIGGER IF EXISTS task_fts_update')
+    op.execute('DROP TRIGGER IF EXISTS task_fts_delete')
+    op.execute('DROP TRIGGER IF EXISTS task_fts_insert')
+    op.execute('DROP TABLE IF EXISTS task_fts')
+    op.execute(f"CREATE VIRTUAL TABLE task_fts USING fts5({columns}, content='task', content_rowid='id')")
+    op.execute("INSERT INTO task_fts (task_fts) VALUES ('rebuild')")
+    for statement in triggers:
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        # btree_gin позволяет поставить todo_list первой колонкой GIN-индекса
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_task_todo_list_note_search', 'task', ['todo_list', 'note_search'], unique=False,
+                postgresql_using='gin', postgresql_concurrently=True,
+            )
+            op.drop_index('ix_task_note_search', table_name='task', postgresql_concurrently=True)
+    else:
+        recreate_sqlite_fts('note, todo_list', SQLITE_TRIGGERS)
+
+
+def downgrade() -> None:
+    # Расширение btree_gin остается: его могут использовать другие индексы
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index('ix_task_note_search', 'task', ['note_search'], unique=False, postgresql_using='gin', postgresql_concurrently=True)
+            op.drop_index('ix_task_todo_list_note_search', table_name='task', postgresql_concurrently=True)
+    else:
+        recreate_sqlite_fts('note', SQLITE_TRIGGERS_OLD)